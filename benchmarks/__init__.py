@@ -0,0 +1 @@
+"""W2A基准测试工具"""
@@ -0,0 +1,294 @@
+"""基准测试用的本地WebDAV服务器和Aria2 JSON-RPC替身"""
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlparse
+from xml.sax.saxutils import escape
+
+
+@dataclass
+class TreeSpec:
+    """合成目录树参数"""
+    fanout: int = 4           # 每个目录下的子目录数
+    depth: int = 3            # 目录层数（根目录为0层）
+    files_per_dir: int = 20   # 每个目录下的文件数
+    latency: float = 0.0      # 每个请求注入的延迟（秒）
+    allow_infinity: bool = False  # 是否支持Depth: infinity
+    extensions: Tuple[str, ...] = ('.mkv', '.mp4', '.nfo', '.srt', '.jpg')
+
+    def total_directories(self) -> int:
+        return sum(self.fanout ** level for level in range(self.depth + 1))
+
+    def total_files(self) -> int:
+        return self.total_directories() * self.files_per_dir
+
+
+class SyntheticTree:
+    """按路径确定性生成的目录树，不在内存中保存整棵树"""
+
+    def __init__(self, spec: TreeSpec):
+        self.spec = spec
+
+    @staticmethod
+    def _split(path: str) -> List[str]:
+        return [part for part in path.split('/') if part]
+
+    def is_directory(self, path: str) -> Optional[bool]:
+        """返回True/False表示目录/文件，None表示不存在"""
+        parts = self._split(path)
+        for level, part in enumerate(parts):
+            is_last = level == len(parts) - 1
+            if part.startswith('dir'):
+                try:
+                    index = int(part[3:])
+                except ValueError:
+                    return None
+                if level >= self.spec.depth or index >= self.spec.fanout:
+                    return None
+            elif is_last and part.startswith('file'):
+                index = part[4:].split('.', 1)[0]
+                if not index.isdigit() or int(index) >= self.spec.files_per_dir:
+                    return None
+                return False
+            else:
+                return None
+        return True
+
+    def file_size(self, path: str) -> int:
+        digest = hashlib.md5(path.encode()).digest()
+        # 1KB ~ 2GB之间的确定性大小
+        return 1024 + int.from_bytes(digest[:4], 'big') % (2 * 1024 ** 3)
+
+    def children(self, path: str) -> Iterator[Tuple[str, bool]]:
+        base = '/' + '/'.join(self._split(path))
+        base = base.rstrip('/') + '/'
+        level = len(self._split(path))
+        if level < self.spec.depth:
+            for index in range(self.spec.fanout):
+                yield f"{base}dir{index}/", True
+        extensions = self.spec.extensions
+        for index in range(self.spec.files_per_dir):
+            yield f"{base}file{index}{extensions[index % len(extensions)]}", False
+
+    def walk(self, path: str) -> Iterator[Tuple[str, bool]]:
+        for child, is_dir in self.children(path):
+            yield child, is_dir
+            if is_dir:
+                yield from self.walk(child)
+
+
+_MODIFIED = formatdate(1700000000, usegmt=True)
+
+
+def _propfind_entry(href: str, is_directory: bool, size: int) -> str:
+    if is_directory:
+        props = '<D:resourcetype><D:collection/></D:resourcetype>'
+    else:
+        props = (f'<D:resourcetype/><D:getcontentlength>{size}</D:getcontentlength>'
+                 '<D:getcontenttype>application/octet-stream</D:getcontenttype>')
+    etag = hashlib.md5(href.encode()).hexdigest()[:16]
+    return (f'<D:response><D:href>{escape(quote(href))}</D:href><D:propstat><D:prop>'
+            f'{props}<D:getlastmodified>{_MODIFIED}</D:getlastmodified>'
+            f'<D:getetag>"{etag}"</D:getetag>'
+            '</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>')
+
+
+class _WebDavHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，不关闭Nagle时每个请求都会遇到约40ms的延迟确认等待
+    disable_nagle_algorithm = True
+    tree: SyntheticTree = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_PROPFIND(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        spec = self.tree.spec
+        if spec.latency:
+            time.sleep(spec.latency)
+
+        path = unquote(urlparse(self.path).path) or '/'
+        kind = self.tree.is_directory(path)
+        if kind is None:
+            self._send(404, b"Not Found")
+            return
+
+        depth = self.headers.get("Depth", "infinity").lower()
+        if depth == "infinity" and not spec.allow_infinity:
+            # RFC 4918: 服务器可以拒绝Depth: infinity
+            self._send(403, b"Depth infinity not supported")
+            return
+
+        href = path if not kind else path.rstrip('/') + '/'
+        parts = ['<?xml version="1.0" encoding="utf-8"?><D:multistatus xmlns:D="DAV:">']
+        parts.append(_propfind_entry(href, kind, 0 if kind else self.tree.file_size(path)))
+        if kind and depth != "0":
+            entries = self.tree.walk(href) if depth == "infinity" else self.tree.children(href)
+            for child, is_dir in entries:
+                parts.append(_propfind_entry(child, is_dir, 0 if is_dir else self.tree.file_size(child)))
+        parts.append('</D:multistatus>')
+        body = ''.join(parts).encode('utf-8')
+        self._send(207, body, 'application/xml; charset="utf-8"')
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        if self.tree.is_directory(path) is False:
+            self._send(200, b"0" * 16, "application/octet-stream")
+        else:
+            self._send(404, b"Not Found")
+
+    do_HEAD = do_GET
+
+
+class _ServerThread:
+    """在后台线程运行的HTTP服务器"""
+
+    def __init__(self, handler_class, host: str = "127.0.0.1", port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), handler_class)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeWebDavServer(_ServerThread):
+    """提供合成目录树的WebDAV服务器"""
+
+    def __init__(self, spec: TreeSpec, host: str = "127.0.0.1", port: int = 0):
+        handler = type("WebDavHandler", (_WebDavHandler,), {"tree": SyntheticTree(spec)})
+        super().__init__(handler, host, port)
+        self.spec = spec
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+
+class _Aria2State:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.downloads: Dict[str, Dict] = {}
+        self.counter = 0
+        self.calls: Dict[str, int] = {}
+
+
+def _aria2_status(gid: str, uri: str, options: Dict, status: str = "waiting") -> Dict:
+    name = options.get("out") or uri.rsplit('/', 1)[-1] or gid
+    return {
+        "gid": gid, "status": status,
+        "totalLength": "0", "completedLength": "0", "uploadLength": "0",
+        "downloadSpeed": "0", "uploadSpeed": "0", "connections": "0",
+        "numPieces": "0", "pieceLength": "1048576", "dir": "/downloads",
+        "files": [{
+            "index": "1", "path": f"/downloads/{name}", "length": "0",
+            "completedLength": "0", "selected": "true",
+            "uris": [{"uri": uri, "status": "used"}],
+        }],
+    }
+
+
+class _Aria2Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state: _Aria2State = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if isinstance(payload, list):
+            response = [self._dispatch(item) for item in payload]
+        else:
+            response = self._dispatch(payload)
+
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, request: Dict) -> Dict:
+        method = request.get("method", "")
+        params = [p for p in request.get("params", []) if not (isinstance(p, str) and p.startswith("token:"))]
+        state = self.state
+        with state.lock:
+            state.calls[method] = state.calls.get(method, 0) + 1
+            if method == "aria2.getVersion":
+                result = {"version": "1.37.0-fake", "enabledFeatures": []}
+            elif method == "aria2.addUri":
+                state.counter += 1
+                gid = f"{state.counter:016x}"
+                options = params[1] if len(params) > 1 else {}
+                state.downloads[gid] = _aria2_status(gid, params[0][0], options)
+                result = gid
+            elif method == "aria2.tellStatus":
+                download = state.downloads.get(params[0])
+                if download is None:
+                    return {"jsonrpc": "2.0", "id": request.get("id"),
+                            "error": {"code": 1, "message": f"GID {params[0]} is not found"}}
+                result = download
+            elif method == "aria2.tellActive":
+                result = [d for d in state.downloads.values() if d["status"] == "active"]
+            elif method == "aria2.tellWaiting":
+                result = [d for d in state.downloads.values() if d["status"] in ("waiting", "paused")]
+            elif method == "aria2.tellStopped":
+                result = [d for d in state.downloads.values() if d["status"] in ("complete", "removed", "error")]
+            elif method in ("aria2.pause", "aria2.forcePause"):
+                state.downloads[params[0]]["status"] = "paused"
+                result = params[0]
+            elif method == "aria2.unpause":
+                state.downloads[params[0]]["status"] = "waiting"
+                result = params[0]
+            elif method in ("aria2.remove", "aria2.forceRemove"):
+                state.downloads[params[0]]["status"] = "removed"
+                result = params[0]
+            else:
+                result = "OK"
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+
+class FakeAria2Server(_ServerThread):
+    """最小化的Aria2 JSON-RPC替身，记录提交的任务和方法调用次数"""
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.state = _Aria2State(latency)
+        handler = type("Aria2Handler", (_Aria2Handler,), {"state": self.state})
+        super().__init__(handler, host, port)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/jsonrpc"
@@ -0,0 +1,266 @@
+"""W2A基准测试
+
+在本地启动合成WebDAV服务器和Aria2替身，测量目录列表、递归扫描以及
+/api/files、/api/download 端到端的吞吐量、延迟分位数和峰值内存，
+结果写入JSON文件以便跨提交比较。
+
+用法（在仓库根目录执行）:
+    python -m benchmarks.run --fanout 4 --depth 3 --files 20 --output bench_output.json
+    python -m benchmarks.run --compare bench_baseline.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List
+
+from benchmarks.fake_servers import FakeAria2Server, FakeWebDavServer, TreeSpec
+
+SCHEMA_VERSION = 1
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(percent / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def measure(fn: Callable[[], int], iterations: int, warmup: int = 1) -> Dict[str, Any]:
+    """多次执行fn并统计延迟；fn返回本次处理的条目数，用于计算吞吐量
+
+    计时与峰值内存分开测量，避免tracemalloc的开销影响延迟数据。
+    """
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    items = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        items += fn()
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "items": items,
+        "elapsed_seconds": round(elapsed, 6),
+        "ops_per_second": round(iterations / elapsed, 3) if elapsed else 0.0,
+        "items_per_second": round(items / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50": round(_percentile(latencies, 50) * 1000, 3),
+            "p90": round(_percentile(latencies, 90) * 1000, 3),
+            "p99": round(_percentile(latencies, 99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3),
+        },
+        "peak_memory_bytes": peak,
+    }
+
+
+def _serve_stand_ins(spec: TreeSpec, aria2_latency: float, queue):
+    webdav = FakeWebDavServer(spec).start()
+    aria2 = FakeAria2Server(aria2_latency).start()
+    queue.put((webdav.url, aria2.url))
+    threading.Event().wait()
+
+
+def start_stand_ins(spec: TreeSpec, aria2_latency: float, in_process: bool):
+    """启动WebDAV和Aria2替身；默认放在子进程中，避免其内存和GIL占用干扰测量"""
+    if in_process:
+        webdav = FakeWebDavServer(spec).start()
+        aria2 = FakeAria2Server(aria2_latency).start()
+        return webdav.url, aria2.url, lambda: (webdav.stop(), aria2.stop())
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve_stand_ins, args=(spec, aria2_latency, queue), daemon=True)
+    process.start()
+    webdav_url, aria2_url = queue.get(timeout=30)
+    return webdav_url, aria2_url, process.terminate
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app():
+    """在后台线程启动FastAPI应用"""
+    import uvicorn
+    import main
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    server.install_signal_handlers = lambda: None
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("应用启动超时")
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+def run_benchmarks(args) -> Dict[str, Any]:
+    import requests
+    import main
+    from webdav_client import WebDavClient
+
+    spec = TreeSpec(
+        fanout=args.fanout, depth=args.depth, files_per_dir=args.files,
+        latency=args.latency_ms / 1000, allow_infinity=args.allow_infinity
+    )
+    webdav_url, aria2_url, stop_stand_ins = start_stand_ins(spec, args.aria2_latency_ms / 1000, args.in_process)
+    app_url, stop_app = start_app()
+    results: Dict[str, Any] = {}
+
+    try:
+        client = WebDavClient(webdav_url)
+
+        def list_root() -> int:
+            return len(client.list_directory("/"))
+        results["list_directory"] = measure(list_root, args.iterations)
+
+        def crawl() -> int:
+            return len(main.get_folder_files_recursive(client, "/"))
+        results["recursive_crawl"] = measure(crawl, args.crawl_iterations)
+
+        http = requests.Session()
+        http.post(f"{app_url}/api/connect/webdav", data={"webdav_url": webdav_url}).raise_for_status()
+        http.post(f"{app_url}/api/connect/aria2", data={"aria2_url": aria2_url}).raise_for_status()
+
+        def api_files() -> int:
+            response = http.get(f"{app_url}/api/files", params={"path": "/"})
+            response.raise_for_status()
+            return len(response.json()["files"])
+        results["api_files"] = measure(api_files, args.iterations)
+
+        def api_export() -> int:
+            count = 0
+            with http.get(f"{app_url}/api/export", params={"path": "/"}, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    count += bool(line)
+            return count
+        results["api_export"] = measure(api_export, args.crawl_iterations)
+
+        subtree = "/dir0/" if spec.depth > 0 and spec.fanout > 0 else "/"
+
+        def api_download() -> int:
+            response = http.post(f"{app_url}/api/download", json={
+                "files": [{"path": subtree, "name": "dir0", "is_directory": True}],
+                "video_filter": False,
+            })
+            response.raise_for_status()
+            return sum(1 for result in response.json()["results"] if result["success"])
+        results["api_download"] = measure(api_download, args.crawl_iterations)
+    finally:
+        stop_app()
+        stop_stand_ins()
+
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tree": {**asdict(spec), "directories": spec.total_directories(), "files": spec.total_files()},
+            "aria2_latency_ms": args.aria2_latency_ms,
+        },
+        "results": results,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> str:
+    """输出与基线结果的对比表"""
+    lines = [f"{'scenario':<20}{'p50 ms':>12}{'Δp50':>9}{'items/s':>14}{'Δitems/s':>9}{'peak bytes':>14}{'Δpeak':>9}"]
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+
+        def delta(new, old):
+            return f"{(new - old) / old * 100:+.1f}%" if base and old else "n/a"
+
+        p50 = result["latency_ms"]["p50"]
+        throughput = result["items_per_second"]
+        peak = result["peak_memory_bytes"]
+        lines.append(
+            f"{name:<20}{p50:>12.3f}{delta(p50, base['latency_ms']['p50'] if base else 0):>9}"
+            f"{throughput:>14.1f}{delta(throughput, base['items_per_second'] if base else 0):>9}"
+            f"{peak:>14}{delta(peak, base['peak_memory_bytes'] if base else 0):>9}"
+        )
+    return "\n".join(lines)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="W2A基准测试")
+    parser.add_argument("--fanout", type=int, default=4, help="每个目录的子目录数")
+    parser.add_argument("--depth", type=int, default=3, help="目录层数")
+    parser.add_argument("--files", type=int, default=20, help="每个目录的文件数")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="WebDAV每个请求注入的延迟")
+    parser.add_argument("--aria2-latency-ms", type=float, default=0.0, help="Aria2每个RPC注入的延迟")
+    parser.add_argument("--allow-infinity", action="store_true", help="WebDAV替身支持Depth: infinity")
+    parser.add_argument("--iterations", type=int, default=50, help="单请求场景的迭代次数")
+    parser.add_argument("--crawl-iterations", type=int, default=3, help="递归场景的迭代次数")
+    parser.add_argument("--in-process", action="store_true", help="替身服务器与测量代码运行在同一进程")
+    parser.add_argument("--output", default="bench_output.json", help="结果输出路径")
+    parser.add_argument("--compare", help="用于对比的基线结果文件")
+    args = parser.parse_args(argv)
+
+    # webdav_client导入时调用basicConfig重设根日志级别，因此直接屏蔽INFO及以下日志，避免测量期间输出扫描日志
+    logging.disable(logging.INFO)
+    report = run_benchmarks(args)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(json.load(f), report))
+    else:
+        for name, result in report["results"].items():
+            latency = result["latency_ms"]
+            print(f"{name:<18} p50={latency['p50']}ms p99={latency['p99']}ms "
+                  f"items/s={result['items_per_second']} peak={result['peak_memory_bytes']}B")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,165 @@
+import gzip
+import hashlib
+import os
+from typing import Any, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+
+# 小于该大小（字节）的响应不压缩
+COMPRESS_MIN_SIZE = int(os.environ.get("W2A_COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("W2A_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("W2A_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript", "application/x-ndjson", "image/svg+xml"
+)
+
+# 压缩后的响应在ETag后附加编码后缀（与原始表示区分），请求的If-None-Match中的后缀由中间件去掉，
+# 接口和静态文件只需与原始ETag比较
+ETAG_SUFFIXES = ("-gzip", "-br")
+
+# 带ETag的接口要求浏览器每次都向服务器验证
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def state_etag(state: Any) -> str:
+    """根据响应所依赖的状态计算强ETag，状态须由基本类型组成（repr稳定）"""
+    return '"' + hashlib.sha256(repr(state).encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _strip_suffix(etag: str) -> str:
+    etag = etag.strip()
+    for suffix in ETAG_SUFFIXES:
+        if etag.endswith(suffix + '"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+
+def _opaque_tag(etag: str) -> str:
+    etag = etag.strip()
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match是否与ETag匹配（弱比较）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    expected = _opaque_tag(etag)
+    return any(_opaque_tag(candidate) == expected for candidate in header.split(","))
+
+
+def _accepted_encodings(header: str) -> List[str]:
+    """解析Accept-Encoding，返回q>0的编码"""
+    accepted = []
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name and quality > 0:
+            accepted.append(name.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware:
+    """gzip/brotli响应压缩（ASGI中间件）
+
+    只压缩单个分块的响应（普通JSON和小文件）；流式响应、已设置Content-Encoding的响应
+    和小于COMPRESS_MIN_SIZE的响应原样输出。brotli需要安装brotli包，未安装时只使用gzip。
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        try:
+            import brotli
+            self._brotli = brotli
+        except ImportError:
+            self._brotli = None
+
+    def _choose_encoding(self, scope) -> Optional[str]:
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if self._brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return self._brotli.compress(body, quality=BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+    @staticmethod
+    def _strip_if_none_match(scope):
+        # 原地修改scope：路由写入的scope["route"]需要对外层中间件（请求耗时指标）可见
+        headers = scope["headers"]
+        for index, (name, value) in enumerate(headers):
+            if name == b"if-none-match":
+                tags = value.decode("latin-1").split(",")
+                stripped = ", ".join(_strip_suffix(tag) for tag in tags)
+                headers = list(headers)
+                headers[index] = (name, stripped.encode("latin-1"))
+                scope["headers"] = headers
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self._choose_encoding(scope)
+        self._strip_if_none_match(scope)
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            # 第一个响应体分块：决定是否压缩
+            passthrough = True
+            headers = MutableHeaders(scope=start_message)
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "")
+            if (message.get("more_body", False)
+                    or "content-encoding" in headers
+                    or len(body) < self.minimum_size
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)):
+                await send(start_message)
+                await send(message)
+                return
+
+            headers.add_vary_header("Accept-Encoding")
+            if encoding is not None:
+                body = self._compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                etag = headers.get("etag")
+                if etag and etag.endswith('"') and not etag.startswith("W/"):
+                    headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+                message = {**message, "body": body}
+            await send(start_message)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+import logging
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from metrics import CRAWL_DIRECTORIES, CRAWL_ENTRIES
+from rollups import get_crawl_executor
+from webdav_client import WebDavClient, WebDavFile
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+EXPORT_FIELDS = ("path", "name", "is_directory", "size", "modified", "etag")
+
+# 同时预取（在途或已完成待输出）的目录列表数上限，决定导出的内存上限
+EXPORT_PREFETCH = int(os.environ.get("W2A_EXPORT_PREFETCH", 16))
+
+# 缓冲达到该大小（字符）时输出一个分块
+CHUNK_SIZE = 64 * 1024
+
+
+class ExportError(Exception):
+    """导出时列出目录失败"""
+
+
+def path_key(path: str) -> Tuple[str, ...]:
+    """导出顺序和游标比较使用的键：路径各段组成的元组
+
+    子项按名称排序的先序遍历恰好是这些元组的字典序，因此游标之前的记录可以直接跳过，
+    完全位于游标之前的子树也不会再被列出。
+    """
+    stripped = path.strip('/')
+    return tuple(stripped.split('/')) if stripped else ()
+
+
+@dataclass
+class _Frame:
+    """遍历栈中的一层：目录中待处理的子项 (文件, 是否输出, 是否进入)"""
+    entries: List[Tuple[WebDavFile, bool, bool]]
+    index: int = 0
+    # 尚未预取的子目录，按遍历顺序排列
+    unfetched: Deque[str] = field(default_factory=deque)
+
+
+class TreeExporter:
+    """按确定的顺序流式遍历目录树
+
+    当前目录之后将要进入的子目录会提前并发列出，同时预取的目录数不超过prefetch，
+    内存占用与目录树总大小无关。
+    """
+
+    def __init__(self, client: WebDavClient, root: str = "/", cursor: str = "",
+                 prefetch: int = EXPORT_PREFETCH):
+        self.client = client
+        self.root = root
+        self.cursor = path_key(cursor) if cursor else None
+        self.prefetch = max(1, prefetch)
+        self.directories = 0
+        self.entries = 0
+        self._pending: Dict[str, Future] = {}
+        self._stack: List[_Frame] = []
+
+    def _classify(self, file: WebDavFile) -> Tuple[bool, bool]:
+        """返回 (是否输出, 是否进入子目录)"""
+        if self.cursor is None:
+            return True, file.is_directory
+        key = path_key(file.path)
+        if key > self.cursor:
+            return True, file.is_directory
+        # 已导出的记录不再输出，但游标位于其子树中的目录仍需进入
+        return False, file.is_directory and self.cursor[:len(key)] == key
+
+    def _list(self, path: str) -> _Frame:
+        future = self._pending.pop(path, None)
+        if future is None:
+            future = get_crawl_executor().submit(self.client.list_directory, path, True)
+        try:
+            files = future.result()
+        except Exception as e:
+            # 不能把列出失败的目录当作空目录，否则清单会静默缺少整个子树
+            raise ExportError(f"列出目录失败: {path}: {e}") from e
+        self.directories += 1
+        CRAWL_DIRECTORIES.inc()
+        CRAWL_ENTRIES.inc(len(files))
+
+        frame = _Frame(entries=[])
+        for file in sorted(files, key=lambda f: path_key(f.path)):
+            emit, descend = self._classify(file)
+            if emit or descend:
+                frame.entries.append((file, emit, descend))
+                if descend:
+                    frame.unfetched.append(file.path)
+        return frame
+
+    def _prefetch(self):
+        """从最深的一层开始，为即将进入的子目录提交列表请求"""
+        executor = get_crawl_executor()
+        for frame in reversed(self._stack):
+            if len(self._pending) >= self.prefetch:
+                break
+            while frame.unfetched and len(self._pending) < self.prefetch:
+                path = frame.unfetched.popleft()
+                self._pending[path] = executor.submit(self.client.list_directory, path, True)
+
+    def walk(self) -> Iterator[Optional[WebDavFile]]:
+        """按路径字典序逐个返回文件和目录（不含起始目录本身）
+
+        即将等待尚未完成的目录列表时返回None，调用方可借此先输出已缓冲的数据。
+        """
+        try:
+            self._stack.append(self._list(self.root))
+            while self._stack:
+                self._prefetch()
+                frame = self._stack[-1]
+                if frame.index >= len(frame.entries):
+                    self._stack.pop()
+                    continue
+                file, emit, descend = frame.entries[frame.index]
+                frame.index += 1
+                if emit:
+                    self.entries += 1
+                    yield file
+                if descend:
+                    if frame.unfetched and frame.unfetched[0] == file.path:
+                        frame.unfetched.popleft()
+                    future = self._pending.get(file.path)
+                    if future is None or not future.done():
+                        yield None
+                    self._stack.append(self._list(file.path))
+        finally:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            self._stack.clear()
+
+
+def _record(file: WebDavFile) -> Dict:
+    return {name: getattr(file, name) for name in EXPORT_FIELDS}
+
+
+def stream_export(exporter: TreeExporter, format: str = "ndjson", compress: bool = False) -> Iterator[bytes]:
+    """将遍历结果编码为NDJSON或CSV分块，可选gzip压缩
+
+    压缩时每个分块都以Z_SYNC_FLUSH结束，连接中断时已收到的部分仍可完整解压。
+    列出目录失败时先输出已缓冲的完整记录，再抛出ExportError中断响应（不发送结束分块和
+    gzip尾部），客户端据此判断清单不完整，并以最后一条记录的路径为游标续传。
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None   # wbits=31: gzip格式
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator="\n") if format == "csv" else None
+
+    def drain() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        if compressor is not None:
+            data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    # 续传时不再重复输出表头，结果可直接追加到已有文件
+    if writer is not None and exporter.cursor is None:
+        writer.writeheader()
+
+    started = time.perf_counter()
+    last_path = ""
+    try:
+        for file in exporter.walk():
+            if file is None:
+                if buffer.tell():
+                    yield drain()
+                continue
+            if writer is not None:
+                record = _record(file)
+                record["is_directory"] = "true" if file.is_directory else "false"
+                writer.writerow(record)
+            else:
+                buffer.write(json.dumps(_record(file), ensure_ascii=False))
+                buffer.write("\n")
+            last_path = file.path
+            if buffer.tell() >= CHUNK_SIZE:
+                yield drain()
+    except ExportError as e:
+        logger.error(f"导出中断: root={exporter.root} cursor={last_path} error={e}")
+        if buffer.tell():
+            yield drain()
+        raise
+
+    data = drain()
+    if compressor is not None:
+        data += compressor.flush()
+    if data:
+        yield data
+
+    logger.info(f"导出完成: root={exporter.root} directories={exporter.directories} "
+                f"entries={exporter.entries} elapsed={time.perf_counter() - started:.3f}s")
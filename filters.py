@@ -0,0 +1,246 @@
+"""文件筛选规则
+
+每行一条规则，#开头为注释：
+
+    include *.mkv               文件名匹配任一include规则才保留（无include规则时全部保留）
+    exclude *sample*            文件名匹配则排除
+    exclude-dir Sample          目录名匹配则整个子树不再扫描
+    include re:/电影/.*\\.mp4$   re:前缀为正则，在完整路径上搜索
+    size >= 300MB               文件大小范围，单位B/KB/MB/GB/TB（1024进制）
+    mtime >= 2024-01-01         修改时间范围，可用绝对日期或相对时间（7d表示7天前）
+    depth <= 3                  相对扫描起点的深度，起点下的直接子项深度为1
+
+不含/的通配符匹配文件（目录）名，含/的匹配完整路径；匹配不区分大小写。
+"""
+
+import fnmatch
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Pattern, Union
+
+from webdav_client import WebDavFile
+
+_SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2,
+               'G': 1024 ** 3, 'GB': 1024 ** 3, 'T': 1024 ** 4, 'TB': 1024 ** 4}
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+_COMPARISON = re.compile(r'^(size|mtime|depth)\s*(>=|<=|>|<)\s*(.+)$', re.IGNORECASE)
+
+
+class FilterRuleError(ValueError):
+    """筛选规则语法错误"""
+
+
+def _parse_size(text: str) -> int:
+    match = re.match(r'^(\d+(?:\.\d+)?)\s*([KMGT]?B?)$', text.strip(), re.IGNORECASE)
+    if not match:
+        raise FilterRuleError(f"无法解析文件大小: {text}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def _parse_time(text: str) -> float:
+    text = text.strip()
+    match = re.match(r'^(\d+)\s*([smhdw])$', text)
+    if match:
+        return time.time() - int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise FilterRuleError(f"无法解析时间: {text}")
+
+
+def parse_modified(modified: str) -> Optional[float]:
+    """解析WebDAV getlastmodified（RFC 1123格式）为时间戳"""
+    if not modified:
+        return None
+    try:
+        return parsedate_to_datetime(modified).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class _PatternSet:
+    """一组通配符/正则规则
+
+    通配符编译成按名称和按路径匹配的两个合并正则；re:规则各自单独编译，
+    避免内联标志、反向引用编号等在合并后失效。
+    """
+
+    def __init__(self):
+        self._name_patterns: List[str] = []
+        self._path_patterns: List[str] = []
+        self.name_regex: Optional[Pattern] = None
+        self.path_regex: Optional[Pattern] = None
+        self.regexes: List[Pattern] = []
+
+    def add(self, pattern: str):
+        if pattern.startswith('re:'):
+            expression = pattern[3:]
+            try:
+                # 在完整路径上搜索
+                self.regexes.append(re.compile(expression, re.IGNORECASE | re.DOTALL))
+            except re.error as e:
+                raise FilterRuleError(f"正则表达式错误 {expression}: {e}")
+        elif '/' in pattern:
+            self._path_patterns.append(fnmatch.translate(pattern))
+        else:
+            self._name_patterns.append(fnmatch.translate(pattern))
+
+    def compile(self):
+        try:
+            if self._name_patterns:
+                self.name_regex = re.compile('|'.join(self._name_patterns), re.IGNORECASE | re.DOTALL)
+            if self._path_patterns:
+                self.path_regex = re.compile('|'.join(self._path_patterns), re.IGNORECASE | re.DOTALL)
+        except re.error as e:
+            raise FilterRuleError(f"通配符规则错误: {e}")
+
+    def __bool__(self):
+        return bool(self._name_patterns or self._path_patterns or self.regexes)
+
+    def matches(self, name: str, path: str) -> bool:
+        if self.name_regex is not None and self.name_regex.match(name):
+            return True
+        if self.path_regex is not None and self.path_regex.match(path):
+            return True
+        return any(regex.search(path) for regex in self.regexes)
+
+
+@dataclass
+class FileFilter:
+    """编译后的筛选规则"""
+    description: str = ""
+    include_reason: str = "未匹配包含规则"
+    include: _PatternSet = field(default_factory=_PatternSet)
+    exclude: _PatternSet = field(default_factory=_PatternSet)
+    exclude_dirs: _PatternSet = field(default_factory=_PatternSet)
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    min_mtime: Optional[float] = None
+    max_mtime: Optional[float] = None
+    min_depth: Optional[int] = None
+    max_depth: Optional[int] = None
+
+    def should_descend(self, directory: WebDavFile, depth: int) -> bool:
+        """是否扫描深度为depth的子目录；返回False时整个子树被剪枝，不会发出PROPFIND"""
+        if self.max_depth is not None and depth + 1 > self.max_depth:
+            return False
+        if self.exclude_dirs:
+            path = directory.path.rstrip('/')
+            if self.exclude_dirs.matches(directory.name, path):
+                return False
+        return True
+
+    def check_file(self, file: WebDavFile, depth: int) -> Optional[str]:
+        """检查文件，符合条件返回None，否则返回不符合的原因"""
+        if self.max_depth is not None and depth > self.max_depth:
+            return "超出目录深度"
+        if self.min_depth is not None and depth < self.min_depth:
+            return "未达到目录深度"
+        if self.include and not self.include.matches(file.name, file.path):
+            return self.include_reason
+        if self.exclude and self.exclude.matches(file.name, file.path):
+            return "匹配排除规则"
+        if self.min_size is not None and file.size < self.min_size:
+            return "文件过小"
+        if self.max_size is not None and file.size > self.max_size:
+            return "文件过大"
+        if self.min_mtime is not None or self.max_mtime is not None:
+            # 无法获取修改时间的文件不受时间规则限制
+            modified = parse_modified(file.modified)
+            if modified is not None:
+                if self.min_mtime is not None and modified < self.min_mtime:
+                    return "修改时间过早"
+                if self.max_mtime is not None and modified > self.max_mtime:
+                    return "修改时间过晚"
+        return None
+
+    def match_file(self, file: WebDavFile, depth: int) -> bool:
+        return self.check_file(file, depth) is None
+
+
+class FilterChain:
+    """多组规则同时生效（逻辑与）"""
+
+    def __init__(self, filters: List[FileFilter]):
+        self.filters = filters
+        self.description = "；".join(f.description for f in filters if f.description)
+
+    def should_descend(self, directory: WebDavFile, depth: int) -> bool:
+        return all(f.should_descend(directory, depth) for f in self.filters)
+
+    def check_file(self, file: WebDavFile, depth: int) -> Optional[str]:
+        for f in self.filters:
+            reason = f.check_file(file, depth)
+            if reason:
+                return reason
+        return None
+
+    def match_file(self, file: WebDavFile, depth: int) -> bool:
+        return self.check_file(file, depth) is None
+
+
+def compile_rules(rules: Union[str, List[str]], description: str = "",
+                  include_reason: str = "") -> FileFilter:
+    """将规则文本（按行）或规则列表编译为FileFilter"""
+    if isinstance(rules, str):
+        lines = rules.splitlines()
+    elif isinstance(rules, (list, tuple)) and all(isinstance(rule, str) for rule in rules):
+        lines = list(rules)
+    else:
+        raise FilterRuleError("筛选规则必须为字符串或字符串列表")
+    file_filter = FileFilter()
+    if include_reason:
+        file_filter.include_reason = include_reason
+    sources = []
+
+    for line_number, raw in enumerate(lines, 1):
+        line = raw.strip()
+        if not line or line.startswith('#'):
+            continue
+        sources.append(line)
+
+        keyword, _, argument = line.partition(' ')
+        keyword = keyword.lower()
+        argument = argument.strip()
+
+        if keyword in ('include', 'exclude', 'exclude-dir'):
+            if not argument:
+                raise FilterRuleError(f"第{line_number}行缺少匹配模式: {line}")
+            target = {'include': file_filter.include, 'exclude': file_filter.exclude,
+                      'exclude-dir': file_filter.exclude_dirs}[keyword]
+            target.add(argument)
+            continue
+
+        match = _COMPARISON.match(line)
+        if not match:
+            raise FilterRuleError(f"第{line_number}行无法识别: {line}")
+        field_name, operator, value = match.group(1).lower(), match.group(2), match.group(3)
+
+        if field_name == 'size':
+            number = _parse_size(value)
+            if operator in ('>=', '>'):
+                file_filter.min_size = number + (1 if operator == '>' else 0)
+            else:
+                file_filter.max_size = number - (1 if operator == '<' else 0)
+        elif field_name == 'mtime':
+            timestamp = _parse_time(value)
+            if operator in ('>=', '>'):
+                file_filter.min_mtime = timestamp
+            else:
+                file_filter.max_mtime = timestamp
+        else:
+            if not value.strip().isdigit():
+                raise FilterRuleError(f"第{line_number}行深度必须为整数: {line}")
+            number = int(value)
+            if operator in ('>=', '>'):
+                file_filter.min_depth = number + (1 if operator == '>' else 0)
+            else:
+                file_filter.max_depth = number - (1 if operator == '<' else 0)
+
+    for pattern_set in (file_filter.include, file_filter.exclude, file_filter.exclude_dirs):
+        pattern_set.compile()
+    file_filter.description = description or "; ".join(sources)
+    return file_filter
@@ -0,0 +1,202 @@
+import logging
+import os
+import posixpath
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from filters import parse_modified
+from webdav_client import WebDavFile
+
+logger = logging.getLogger(__name__)
+
+# Aria2未完成下载的控制文件后缀
+CONTROL_SUFFIX = ".aria2"
+
+# 本地文件修改时间早于远程修改时间超过该值（秒）时视为远程已更新
+MTIME_TOLERANCE = 2.0
+
+# 同一目录的两次刷新之间的最小间隔（秒）
+MIN_REFRESH_INTERVAL = 5.0
+
+# 同步动作
+SYNC_MISSING = "missing"
+SYNC_PARTIAL = "partial"
+SYNC_CHANGED = "changed"
+SYNC_SAME = "same"
+SYNC_IN_PROGRESS = "in_progress"
+
+
+@dataclass
+class _DirectoryState:
+    mtime_ns: int
+    files: Dict[str, Tuple[int, float]] = field(default_factory=dict)   # 文件名 -> (大小, 修改时间)
+    partial: Set[str] = field(default_factory=set)                      # 存在.aria2控制文件的文件名
+    subdirs: List[str] = field(default_factory=list)
+
+
+class LocalIndex:
+    """本地下载目录的索引，基于os.scandir构建
+
+    按目录缓存扫描结果：刷新时目录的mtime未变化就复用上次的文件列表，
+    只有新增、删除文件（包括.aria2控制文件的出现和消失）的目录会被重新扫描。
+    文件的大小和修改时间在lookup时重新读取。
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self._dirs: Dict[str, _DirectoryState] = {}
+        self._lock = threading.Lock()
+        self._refreshed_at = 0.0
+
+    def refresh(self, force: bool = False) -> "LocalIndex":
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed_at < MIN_REFRESH_INTERVAL:
+                return self
+            started = time.perf_counter()
+            seen: Set[str] = set()
+            rescanned = self._refresh_dir("", seen)
+            # 删除已不存在的目录
+            for rel_dir in set(self._dirs) - seen:
+                del self._dirs[rel_dir]
+            self._refreshed_at = time.monotonic()
+            logger.info("本地索引刷新完成: root=%s dirs=%d rescanned=%d elapsed=%.3fs",
+                        self.root, len(self._dirs), rescanned, time.perf_counter() - started)
+        return self
+
+    def _refresh_dir(self, rel_dir: str, seen: Set[str]) -> int:
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+        seen.add(rel_dir)
+
+        rescanned = 0
+        state = self._dirs.get(rel_dir)
+        if state is None or state.mtime_ns != mtime_ns:
+            state = self._scan_dir(path, mtime_ns)
+            self._dirs[rel_dir] = state
+            rescanned = 1
+
+        for name in state.subdirs:
+            rescanned += self._refresh_dir(posixpath.join(rel_dir, name) if rel_dir else name, seen)
+        return rescanned
+
+    @staticmethod
+    def _scan_dir(path: str, mtime_ns: int) -> _DirectoryState:
+        state = _DirectoryState(mtime_ns=mtime_ns)
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            state.subdirs.append(entry.name)
+                        elif entry.name.endswith(CONTROL_SUFFIX):
+                            state.partial.add(entry.name[:-len(CONTROL_SUFFIX)])
+                        else:
+                            stat = entry.stat(follow_symlinks=False)
+                            state.files[entry.name] = (stat.st_size, stat.st_mtime)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"扫描本地目录失败: {path}: {e}")
+        return state
+
+    def lookup(self, rel_path: str) -> Tuple[Optional[Tuple[int, float]], bool]:
+        """返回 (文件大小和修改时间或None, 是否存在.aria2控制文件)
+
+        原地重写文件不会改变目录的mtime，因此命中索引的文件会重新stat，
+        索引只用于判断文件是否存在，避免逐个stat不存在的文件。
+        """
+        rel_dir, name = posixpath.split(rel_path.strip('/'))
+        state = self._dirs.get(rel_dir)
+        if state is None:
+            return None, False
+        partial = name in state.partial
+        if name not in state.files:
+            return None, partial
+        try:
+            stat = os.stat(os.path.join(self.root, rel_dir, name))
+        except OSError:
+            state.files.pop(name, None)
+            return None, partial
+        state.files[name] = (stat.st_size, stat.st_mtime)
+        return state.files[name], partial
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "directories": len(self._dirs),
+            "files": sum(len(s.files) for s in self._dirs.values()),
+            "partial": sum(len(s.partial) for s in self._dirs.values())
+        }
+
+
+_indexes: Dict[str, LocalIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_local_index(root: str) -> LocalIndex:
+    """获取（并增量刷新）本地目录索引，索引在进程内按目录缓存"""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = LocalIndex(root)
+    return index.refresh()
+
+
+class SyncPlan:
+    """比较远程文件与本地目录，决定是否提交下载"""
+
+    def __init__(self, index: LocalIndex, aria2_dir: str = "", preserve_tree: bool = False,
+                 in_progress_urls: Optional[Set[str]] = None):
+        self.index = index
+        self.aria2_dir = aria2_dir
+        self.preserve_tree = preserve_tree
+        self.in_progress_urls = in_progress_urls or set()
+        self.counts = {action: 0 for action in (SYNC_MISSING, SYNC_PARTIAL, SYNC_CHANGED, SYNC_SAME, SYNC_IN_PROGRESS)}
+
+    def relative_path(self, file: WebDavFile, base_path: str) -> str:
+        """本地相对路径：保留目录结构时相对于所选文件夹的上级目录，否则只用文件名"""
+        if not self.preserve_tree:
+            return file.name
+        parent = posixpath.dirname(base_path.rstrip('/'))
+        return posixpath.relpath(file.path, parent or '/')
+
+    def decide(self, file: WebDavFile, download_url: str, base_path: str) -> Tuple[str, Dict[str, str]]:
+        """返回 (同步动作, Aria2选项)"""
+        rel_path = self.relative_path(file, base_path)
+        options = {"out": posixpath.basename(rel_path)}
+        rel_dir = posixpath.dirname(rel_path)
+        if self.aria2_dir or rel_dir:
+            options["dir"] = posixpath.join(self.aria2_dir or self.index.root, rel_dir)
+
+        if download_url in self.in_progress_urls:
+            action = SYNC_IN_PROGRESS
+        else:
+            local, partial = self.index.lookup(rel_path)
+            if local is None:
+                action = SYNC_MISSING
+            elif partial:
+                action = SYNC_PARTIAL
+                # 续传未完成的下载
+                options["continue"] = "true"
+            else:
+                local_size, local_mtime = local
+                remote_mtime = parse_modified(file.modified)
+                if local_size != file.size or (remote_mtime is not None and remote_mtime > local_mtime + MTIME_TOLERANCE):
+                    action = SYNC_CHANGED
+                    options["allow-overwrite"] = "true"
+                else:
+                    action = SYNC_SAME
+
+        self.counts[action] += 1
+        return action, options
+
+    def summary(self) -> str:
+        counts = self.counts
+        return (f"同步完成：新增{counts[SYNC_MISSING]}个，续传{counts[SYNC_PARTIAL]}个，"
+                f"已变更{counts[SYNC_CHANGED]}个，已是最新{counts[SYNC_SAME]}个，"
+                f"下载中{counts[SYNC_IN_PROGRESS]}个")
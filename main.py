@@ -1,12 +1,32 @@
 from fastapi import FastAPI, Request, Form, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from typing import List, Dict, Any
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
 import json
 import os
+import time
 import logging
 from webdav_client import WebDavClient, Aria2Client, WebDavFile
+from metrics import (
+    REGISTRY, CONTENT_TYPE_LATEST, CRAWL_SECONDS, CRAWL_DIRECTORIES, CRAWL_ENTRIES, CRAWL_PRUNED,
+    ARIA2_SUBMISSIONS, HTTP_REQUEST_SECONDS
+)
+from state_store import create_state_store
+from filters import FileFilter, FilterChain, FilterRuleError, compile_rules
+from compression import CompressionMiddleware, state_etag, etag_matches, REVALIDATE_CACHE_CONTROL
+from export import TreeExporter, stream_export, EXPORT_FORMATS, EXPORT_MEDIA_TYPES
+from rollups import RollupCache, compute_folder_rollup, directory_validator
+from local_index import SyncPlan, get_local_index, SYNC_SAME, SYNC_IN_PROGRESS
+from sessions import (
+    SessionRegistry, ClientSession, SESSION_COOKIE, API_TOKEN_HEADER, new_session_id, session_id_for_token,
+    is_valid_session_id
+)
+from startup import StartupConfig, Readiness, Prewarmer
+from profiling import (
+    ProfileSession, ProfiledRoute, ProfilerBusyError, check_admin_token, MAX_PROFILE_SECONDS, PROFILE_MODES
+)
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -28,8 +48,74 @@ def is_video_file(filename: str) -> bool:
     extension = os.path.splitext(filename.lower())[1]
     return extension in VIDEO_EXTENSIONS
 
+# 目录汇总中“视频大小”的默认最小文件大小（MB）
+DEFAULT_MIN_FILE_SIZE_MB = 300
+
+def get_rollup_cache(webdav_client: WebDavClient, min_file_size_mb: int = DEFAULT_MIN_FILE_SIZE_MB) -> RollupCache:
+    """获取目录汇总缓存"""
+    return RollupCache(state_store, webdav_client, min_file_size_mb * 1024 * 1024)
+
+def build_file_filter(video_filter: bool, min_file_size_mb: int, filter_rules=None) -> Optional[FilterChain]:
+    """根据视频筛选开关和自定义规则构建筛选器，两者同时生效"""
+    filters: List[FileFilter] = []
+    
+    if video_filter:
+        video_rules = [f"include *{extension}" for extension in sorted(VIDEO_EXTENSIONS)]
+        video_rules.append(f"size >= {min_file_size_mb}MB")
+        filters.append(compile_rules(
+            video_rules, description=f"视频文件≥{min_file_size_mb}MB", include_reason="非视频文件"
+        ))
+    
+    if filter_rules:
+        filters.append(compile_rules(filter_rules))
+    
+    return FilterChain(filters) if filters else None
+
+def build_sync_plan(aria2_client: Aria2Client, sync_options) -> SyncPlan:
+    """构建同步计划：索引本地目录，并记录Aria2中正在进行的任务以免重复提交"""
+    if not isinstance(sync_options, dict):
+        sync_options = {}
+    
+    # 只允许同步W2A_SYNC_DIR及其子目录，避免请求方让服务扫描任意路径
+    sync_root = os.environ.get("W2A_SYNC_DIR", "")
+    if not sync_root:
+        raise ValueError("未设置本地同步目录W2A_SYNC_DIR")
+    for name in ("local_dir", "aria2_dir"):
+        if not isinstance(sync_options.get(name) or "", str):
+            raise ValueError(f"{name}必须为字符串")
+    sync_root = os.path.realpath(sync_root)
+    local_dir = os.path.realpath(os.path.join(sync_root, sync_options.get("local_dir") or ""))
+    if os.path.commonpath([sync_root, local_dir]) != sync_root:
+        raise ValueError(f"本地同步目录必须位于W2A_SYNC_DIR之下: {sync_options.get('local_dir')}")
+    if not os.path.isdir(local_dir):
+        raise ValueError(f"本地同步目录不存在: {local_dir}")
+    
+    try:
+        downloads = aria2_client.get_downloads()
+    except Exception as e:
+        raise ConnectionError(f"获取Aria2任务列表失败: {e}") from e
+    
+    in_progress_urls = set()
+    for download in downloads:
+        if download["status"] in ("active", "waiting", "paused"):
+            for file in download["files"]:
+                in_progress_urls.update(uri["uri"] for uri in file["uris"])
+    
+    return SyncPlan(
+        get_local_index(local_dir),
+        aria2_dir=sync_options.get("aria2_dir") or "",
+        preserve_tree=bool(sync_options.get("preserve_tree", False)),
+        in_progress_urls=in_progress_urls
+    )
+
 app = FastAPI(title="WebDAV网盘监控工具", description="监控WebDAV网盘并支持批量下载到Aria2")
 
+# mode=cprofile在执行接口函数的线程（同步接口为线程池）中分析，须在注册接口前设置
+app.router.route_class = ProfiledRoute
+
+# 压缩较大的JSON和静态文件响应（gzip，安装brotli后优先使用br）
+app.add_middleware(CompressionMiddleware)
+
 # 创建静态文件和模板目录
 os.makedirs("static", exist_ok=True)
 os.makedirs("templates", exist_ok=True)
@@ -37,30 +123,235 @@ os.makedirs("templates", exist_ok=True)
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# 模板配置
-templates = Jinja2Templates(directory="templates")
+# 模板引擎在首次访问主页时才加载，不拖慢启动和API请求
+_templates = None
+
+def get_templates():
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory="templates")
+    return _templates
+
+# 共享状态存储（W2A_STATE_STORE），多worker部署时使用sqlite后端
+state_store = create_state_store()
+
+# 会话注册表：每个浏览器会话或API令牌持有独立的客户端
+registry = SessionRegistry.from_env(store=state_store)
+
+# 启动配置（W2A_CONFIG配置文件或W2A_WEBDAV_URL等环境变量），启动后在后台建立并预热连接
+startup_config = StartupConfig.load()
+readiness = Readiness()
+
+# 空闲会话回收间隔（秒）
+SESSION_SWEEP_INTERVAL = 60
+
+# 最近一次单请求性能分析结果保存在状态存储中，任意worker均可读取
+PROFILE_NAMESPACE = "profile"
+LAST_REQUEST_PROFILE_KEY = "last_request"
+
+def get_session(request: Request) -> Optional[ClientSession]:
+    """获取当前请求所属的会话"""
+    return registry.get(request.state.session_id)
+
+def get_session_clients(request: Request) -> Tuple[Optional[WebDavClient], Optional[Aria2Client]]:
+    """获取当前会话的WebDAV和Aria2客户端"""
+    session = get_session(request)
+    webdav_client = session.webdav_client if session else None
+    aria2_client = session.aria2_client if session else None
+    
+    # 会话自身未连接时使用启动配置的连接
+    if (webdav_client is None or aria2_client is None) and startup_config.is_default:
+        default_session = registry.get(startup_config.session_id)
+        if default_session:
+            webdav_client = webdav_client or default_session.webdav_client
+            aria2_client = aria2_client or default_session.aria2_client
+    
+    return webdav_client, aria2_client
+
+def conditional_json(request: Request, content: Dict[str, Any], state: Any) -> Response:
+    """返回带强ETag的JSON响应；state与浏览器缓存的版本一致时返回304，不再序列化响应体"""
+    etag = state_etag(state)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content, headers=headers)
+
+def require_admin(request: Request):
+    """校验管理员令牌（X-Admin-Token请求头）"""
+    if not check_admin_token(request.headers.get("X-Admin-Token")):
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """记录HTTP接口耗时"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # 使用路由模板作为标签，避免gid等路径参数导致标签爆炸
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method, route=route_path, status=str(status)
+        )
+
+@app.middleware("http")
+async def assign_session(request: Request, call_next):
+    """为请求分配会话ID：优先使用API令牌，其次使用浏览器Cookie；格式不符的Cookie重新分配"""
+    token = request.headers.get(API_TOKEN_HEADER)
+    cookie = request.cookies.get(SESSION_COOKIE)
+    is_new = False
+    if token:
+        session_id = session_id_for_token(token)
+    elif is_valid_session_id(cookie):
+        session_id = cookie
+    else:
+        session_id = new_session_id()
+        is_new = True
+    request.state.session_id = session_id
+    
+    response = await call_next(request)
+    if is_new:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return response
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    """定期回收空闲会话"""
+    async def sweep():
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            registry.evict_idle()
+    
+    app.state.session_sweeper = asyncio.create_task(sweep())
+
+@app.on_event("startup")
+async def prewarm_connections():
+    """按启动配置在后台建立连接，不阻塞服务启动"""
+    app.state.prewarm_tasks = Prewarmer(registry, startup_config, readiness).start()
+
+@app.on_event("shutdown")
+async def close_sessions():
+    """关闭所有会话的连接池"""
+    app.state.session_sweeper.cancel()
+    for task in app.state.prewarm_tasks:
+        task.cancel()
+    registry.close_all()
+    state_store.close()
+
+@app.middleware("http")
+async def profile_single_request(request: Request, call_next):
+    """带X-W2A-Profile请求头的管理员请求单独进行性能分析"""
+    mode = request.headers.get("X-W2A-Profile")
+    if not mode or mode not in PROFILE_MODES or not check_admin_token(request.headers.get("X-Admin-Token")):
+        return await call_next(request)
+    
+    session = ProfileSession(mode, single_request=True)
+    try:
+        session.start()
+    except ProfilerBusyError:
+        return await call_next(request)
+    
+    try:
+        response = await call_next(request)
+    finally:
+        result = session.stop()
+        result["request"] = f"{request.method} {request.url.path}"
+        state_store.set(PROFILE_NAMESPACE, LAST_REQUEST_PROFILE_KEY, result)
+    
+    response.headers["X-W2A-Profile-Result"] = "/api/admin/profile/last"
+    return response
+
+@app.get("/api/health")
+async def health():
+    """存活探针"""
+    return {"status": "ok"}
+
+@app.get("/api/ready")
+async def ready():
+    """就绪探针：启动配置的连接全部预热完成前返回503"""
+    snapshot = readiness.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus指标"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/api/admin/profile")
+async def run_profile(
+    request: Request,
+    mode: str = "sample",
+    duration: float = 10,
+    interval_ms: float = 10,
+    top: int = 30,
+    format: str = "json"
+):
+    """在指定时间窗口内进行性能分析，返回折叠栈和内存分配热点"""
+    require_admin(request)
+    
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode必须为: {', '.join(PROFILE_MODES)}")
+    if not 0 < duration <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"duration必须在0到{MAX_PROFILE_SECONDS}秒之间")
+    
+    session = ProfileSession(mode, interval=max(interval_ms, 1) / 1000)
+    try:
+        session.start()
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        result = session.stop(top)
+    
+    if format == "collapsed":
+        return Response(result["collapsed"], media_type="text/plain; charset=utf-8")
+    
+    return {
+        "success": True,
+        **result
+    }
 
-# 全局客户端实例
-webdav_client = None
-aria2_client = None
+@app.get("/api/admin/profile/last")
+async def get_last_request_profile(request: Request, format: str = "json"):
+    """获取最近一次单请求性能分析结果"""
+    require_admin(request)
+    
+    last_request_profile = state_store.get(PROFILE_NAMESPACE, LAST_REQUEST_PROFILE_KEY)
+    if last_request_profile is None:
+        raise HTTPException(status_code=404, detail="暂无单请求分析结果")
+    
+    if format == "collapsed":
+        return Response(last_request_profile["collapsed"], media_type="text/plain; charset=utf-8")
+    
+    return {
+        "success": True,
+        **last_request_profile
+    }
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """主页"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return get_templates().TemplateResponse("index.html", {"request": request})
 
 @app.post("/api/connect/webdav")
-async def connect_webdav(
+def connect_webdav(
+    request: Request,
     webdav_url: str = Form(...),
     username: str = Form(""),
     password: str = Form("")
 ):
     """连接WebDAV服务器"""
-    global webdav_client
-    
     try:
-        # 初始化WebDAV客户端
-        webdav_client = WebDavClient(webdav_url, username, password)
+        # 初始化当前会话的WebDAV客户端
+        webdav_client = registry.connect_webdav(request.state.session_id, webdav_url, username, password)
         
         # 测试WebDAV连接
         webdav_client.list_directory("/")
@@ -78,16 +369,15 @@ async def connect_webdav(
         })
 
 @app.post("/api/connect/aria2")
-async def connect_aria2(
+def connect_aria2(
+    request: Request,
     aria2_url: str = Form(...),
     aria2_secret: str = Form("")
 ):
     """连接Aria2服务器"""
-    global aria2_client
-    
     try:
-        # 初始化Aria2客户端
-        aria2_client = Aria2Client(aria2_url, aria2_secret)
+        # 初始化当前会话的Aria2客户端
+        aria2_client = registry.connect_aria2(request.state.session_id, aria2_url, aria2_secret)
         
         # 测试Aria2连接
         aria2_connected = aria2_client.test_connection()
@@ -111,8 +401,9 @@ async def connect_aria2(
         })
 
 @app.get("/api/status")
-async def get_connection_status():
+def get_connection_status(request: Request):
     """获取连接状态"""
+    webdav_client, aria2_client = get_session_clients(request)
     webdav_status = webdav_client is not None
     aria2_status = aria2_client is not None and aria2_client.test_connection()
     
@@ -121,31 +412,62 @@ async def get_connection_status():
         "aria2_connected": aria2_status
     })
 
+@app.get("/api/webdav/transport")
+async def get_transport_stats(request: Request):
+    """获取WebDAV连接池和重试统计"""
+    webdav_client, _ = get_session_clients(request)
+    if not webdav_client:
+        raise HTTPException(status_code=400, detail="请先连接WebDAV服务器")
+    
+    return {
+        "success": True,
+        "stats": webdav_client.transport_stats(),
+        "sessions": registry.stats()
+    }
+
 @app.get("/api/files")
-async def list_files(path: str = "/"):
+def list_files(request: Request, path: str = "/"):
     """获取文件列表"""
+    webdav_client, _ = get_session_clients(request)
     if not webdav_client:
         raise HTTPException(status_code=400, detail="请先连接WebDAV服务器")
     
     try:
         files = webdav_client.list_directory(path)
         
+        rollup_cache = get_rollup_cache(webdav_client)
+        
         # 转换为JSON格式
         file_list = []
         for file in files:
-            file_list.append({
+            item = {
                 "name": file.name,
                 "path": file.path,
                 "is_directory": file.is_directory,
                 "size": file.size,
+                "modified": file.modified,
                 "download_url": file.download_url
-            })
+            }
+            
+            # 目录的ETag/修改时间未变化时，直接使用缓存的汇总大小
+            if file.is_directory:
+                rollup = rollup_cache.get(file.path, directory_validator(file))
+                item["rollup"] = None
+                if rollup:
+                    item["size"] = rollup.size
+                    item["rollup"] = {
+                        "file_count": rollup.file_count,
+                        "directory_count": rollup.directory_count,
+                        "video_size": rollup.video_size
+                    }
+            
+            file_list.append(item)
         
-        return {
+        return conditional_json(request, {
             "success": True,
             "files": file_list,
             "current_path": path
-        }
+        }, (path, file_list))
         
     except Exception as e:
         return {
@@ -153,9 +475,74 @@ async def list_files(path: str = "/"):
             "message": f"获取文件列表失败: {str(e)}"
         }
 
+@app.get("/api/folders/size")
+async def get_folder_size(
+    request: Request,
+    path: str = "/",
+    min_file_size_mb: int = DEFAULT_MIN_FILE_SIZE_MB,
+    refresh: bool = False
+):
+    """递归统计目录大小、文件数和符合条件的视频大小"""
+    webdav_client, _ = get_session_clients(request)
+    if not webdav_client:
+        raise HTTPException(status_code=400, detail="请先连接WebDAV服务器")
+    
+    min_size = min_file_size_mb * 1024 * 1024
+    
+    def is_eligible_video(file: WebDavFile) -> bool:
+        return is_video_file(file.name) and file.size >= min_size
+    
+    try:
+        started = time.perf_counter()
+        rollup, cached = await run_in_threadpool(
+            compute_folder_rollup, webdav_client, path,
+            get_rollup_cache(webdav_client, min_file_size_mb), is_eligible_video, refresh
+        )
+        return {
+            "success": True,
+            "path": path,
+            "size": rollup.size,
+            "file_count": rollup.file_count,
+            "directory_count": rollup.directory_count,
+            "video_size": rollup.video_size,
+            "failed_directories": rollup.failed_directories,
+            "cached": cached,
+            "elapsed": round(time.perf_counter() - started, 3)
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "message": f"统计目录大小失败: {str(e)}"
+        }
+
+@app.get("/api/export")
+async def export_tree(
+    request: Request,
+    path: str = "/",
+    format: str = "ndjson",
+    gzip: bool = False,
+    cursor: str = ""
+):
+    """流式导出目录树中所有文件和目录的清单，连接中断后可从游标（最后收到的路径）续传"""
+    webdav_client, _ = get_session_clients(request)
+    if not webdav_client:
+        raise HTTPException(status_code=400, detail="请先连接WebDAV服务器")
+    
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format必须为: {', '.join(EXPORT_FORMATS)}")
+    
+    exporter = TreeExporter(webdav_client, path, cursor)
+    filename = f"export.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        stream_export(exporter, format, gzip),
+        media_type="application/gzip" if gzip else EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.post("/api/download")
-async def add_downloads(request: Dict[str, Any]):
+def add_downloads(request: Dict[str, Any], http_request: Request):
     """批量添加下载任务到Aria2"""
+    webdav_client, aria2_client = get_session_clients(http_request)
     if not webdav_client:
         raise HTTPException(status_code=400, detail="WebDAV未连接")
     
@@ -166,6 +553,21 @@ async def add_downloads(request: Dict[str, Any]):
     video_filter = request.get("video_filter", False)
     min_file_size_mb = request.get("min_file_size_mb", 300)  # 默认300MB
     
+    try:
+        file_filter = build_file_filter(video_filter, min_file_size_mb, request.get("filter_rules"))
+    except FilterRuleError as e:
+        raise HTTPException(status_code=400, detail=f"筛选规则错误: {e}")
+    
+    # 同步模式：只提交本地缺失、未完成或已变更的文件
+    sync_plan = None
+    if request.get("sync"):
+        try:
+            sync_plan = build_sync_plan(aria2_client, request.get("sync"))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except ConnectionError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+    
     results = []
     
     for file_info in files:
@@ -186,7 +588,9 @@ async def add_downloads(request: Dict[str, Any]):
             # 如果是文件夹，递归获取所有文件并下载
             if is_directory:
                 try:
-                    folder_results = download_folder_recursive(file_path, filename, video_filter, min_file_size_mb)
+                    folder_results = download_folder_recursive(
+                        webdav_client, aria2_client, file_path, filename, file_filter, sync_plan
+                    )
                     results.extend(folder_results)
                 except Exception as e:
                     results.append({
@@ -196,13 +600,18 @@ async def add_downloads(request: Dict[str, Any]):
                     })
             else:
                 # 单个文件下载
-                # 如果启用视频筛选，检查是否符合条件
-                if video_filter:
-                    if not is_video_file(filename) or file_size < min_file_size_mb * 1024 * 1024:
+                # 如果启用筛选，检查是否符合条件
+                if file_filter:
+                    candidate = WebDavFile(
+                        name=filename, path=file_path, is_directory=False,
+                        size=file_size, modified=file_info.get("modified", "")
+                    )
+                    reason = file_filter.check_file(candidate, depth=1)
+                    if reason:
                         results.append({
                             "filename": filename,
                             "success": False,
-                            "message": f"不符合视频文件筛选条件（非视频文件或小于{min_file_size_mb}MB）"
+                            "message": f"不符合筛选条件：{reason}（{file_filter.description}）"
                         })
                         continue
                 
@@ -210,7 +619,23 @@ async def add_downloads(request: Dict[str, Any]):
                 download_url = webdav_client._build_download_url(file_path)
                 
                 # 添加到Aria2（保留原始文件名，使用默认下载路径）
-                gid = aria2_client.add_download(download_url, {"out": filename})
+                options = {"out": filename}
+                if sync_plan:
+                    candidate = WebDavFile(
+                        name=filename, path=file_path, is_directory=False,
+                        size=file_size, modified=file_info.get("modified", "")
+                    )
+                    action, options = sync_plan.decide(candidate, download_url, file_path)
+                    if action in (SYNC_SAME, SYNC_IN_PROGRESS):
+                        results.append({
+                            "filename": filename,
+                            "success": True,
+                            "message": "已是最新，跳过" if action == SYNC_SAME else "正在下载中，跳过"
+                        })
+                        continue
+                
+                gid = aria2_client.add_download(download_url, options)
+                ARIA2_SUBMISSIONS.inc(result="success" if gid else "failure")
                 
                 if gid:
                     results.append({
@@ -227,58 +652,45 @@ async def add_downloads(request: Dict[str, Any]):
                     })
             
         except Exception as e:
+            ARIA2_SUBMISSIONS.inc(result="error")
             results.append({
                 "filename": file_info.get("name", "未知文件"),
                 "success": False,
                 "message": f"添加失败: {str(e)}"
             })
     
-    return {
+    response = {
         "success": True,
         "results": results
     }
+    if sync_plan:
+        response["sync"] = {
+            "counts": sync_plan.counts,
+            "message": sync_plan.summary()
+        }
+    return response
 
-def download_folder_recursive(folder_path: str, folder_name: str, video_filter: bool, min_file_size_mb: int) -> List[Dict[str, Any]]:
+def download_folder_recursive(webdav_client: WebDavClient, aria2_client: Aria2Client, folder_path: str,
+                              folder_name: str, file_filter: Optional[FilterChain] = None,
+                              sync_plan: Optional[SyncPlan] = None) -> List[Dict[str, Any]]:
     """递归下载文件夹中的所有文件"""
     results = []
     
     try:
-        print(f"开始处理文件夹: {folder_path}")
-        
-        # 获取文件夹中的所有文件
-        all_files = get_folder_files_recursive(folder_path)
-        print(f"找到 {len(all_files)} 个文件")
+        logger.info("开始处理文件夹: path=%s", folder_path)
         
-        # 统计符合条件的文件数量
-        eligible_files = []
-        skipped_files = []
+        # 扫描时直接应用筛选规则，被排除的目录不会被扫描
+        skipped = []
+        eligible_files = get_folder_files_recursive(webdav_client, folder_path, file_filter, skipped)
+        skipped_files = [f"{file.name} ({reason})" for file, reason in skipped]
+        checked_count = len(eligible_files) + len(skipped)
         
-        for file in all_files:
-            print(f"检查文件: {file.name}, 大小: {file.size}, 是否目录: {file.is_directory}")
-            
-            if file.is_directory:
-                continue  # 跳过子文件夹
-            
-            # 如果启用视频筛选，检查文件是否符合条件
-            if video_filter:
-                if not is_video_file(file.name):
-                    skipped_files.append(f"{file.name} (非视频文件)")
-                    print(f"跳过非视频文件: {file.name}")
-                    continue
-                if file.size < min_file_size_mb * 1024 * 1024:
-                    skipped_files.append(f"{file.name} (小于{min_file_size_mb}MB)")
-                    print(f"跳过小文件: {file.name} ({file.size} bytes < {min_file_size_mb * 1024 * 1024} bytes)")
-                    continue
-            
-            eligible_files.append(file)
-            print(f"符合条件的文件: {file.name}")
+        logger.info("文件筛选完成: path=%s eligible=%d skipped=%d",
+                    folder_path, len(eligible_files), len(skipped_files))
         
-        print(f"符合条件的文件数量: {len(eligible_files)}")
-        print(f"跳过的文件数量: {len(skipped_files)}")
-        
-        # 如果启用了视频筛选但没有符合条件的文件
-        if video_filter and len(eligible_files) == 0:
-            message = f"文件夹中没有符合条件的视频文件（≥{min_file_size_mb}MB）。共检查了{len(all_files)}个文件。"
+        # 如果启用了筛选但没有符合条件的文件
+        if file_filter and len(eligible_files) == 0:
+            message = f"文件夹中没有符合条件的文件（{file_filter.description}）。共检查了{checked_count}个文件。"
             if len(skipped_files) > 0:
                 message += f" 跳过的文件: {', '.join(skipped_files[:5])}"
                 if len(skipped_files) > 5:
@@ -291,29 +703,35 @@ def download_folder_recursive(folder_path: str, folder_name: str, video_filter:
             })
             return results
         
-        # 如果没有启用视频筛选但文件夹为空
-        if not video_filter and len(eligible_files) == 0:
+        # 如果没有启用筛选但文件夹为空
+        if not file_filter and len(eligible_files) == 0:
             results.append({
                 "filename": folder_name,
                 "success": False,
-                "message": f"文件夹为空或无法访问文件。共检查了{len(all_files)}个文件。"
+                "message": f"文件夹为空或无法访问文件。共检查了{checked_count}个文件。"
             })
             return results
         
         # 处理符合条件的文件
         for file in eligible_files:
             try:
-                print(f"开始下载文件: {file.name}")
-                
                 # 构建下载URL
                 download_url = webdav_client._build_download_url(file.path)
-                print(f"下载URL: {download_url}")
                 
                 # 添加到Aria2（保留原始文件名，使用默认下载路径）
                 options = {"out": file.name}
-                print(f"Aria2选项: {options}")
+                if sync_plan:
+                    action, options = sync_plan.decide(file, download_url, folder_path)
+                    if action in (SYNC_SAME, SYNC_IN_PROGRESS):
+                        results.append({
+                            "filename": file.name,
+                            "success": True,
+                            "message": "已是最新，跳过" if action == SYNC_SAME else "正在下载中，跳过"
+                        })
+                        continue
                 
                 gid = aria2_client.add_download(download_url, options)
+                ARIA2_SUBMISSIONS.inc(result="success" if gid else "failure")
                 
                 if gid:
                     results.append({
@@ -322,23 +740,24 @@ def download_folder_recursive(folder_path: str, folder_name: str, video_filter:
                         "gid": gid,
                         "message": "添加成功"
                     })
-                    print(f"成功添加下载任务: {gid}")
+                    logger.debug("成功添加下载任务: name=%s gid=%s", file.name, gid)
                 else:
                     results.append({
                         "filename": file.name,
                         "success": False,
                         "message": "添加下载任务失败"
                     })
-                    print(f"添加下载任务失败: {file.name}")
+                    logger.warning("添加下载任务失败: name=%s", file.name)
                     
             except Exception as e:
+                ARIA2_SUBMISSIONS.inc(result="error")
                 error_msg = f"添加失败: {str(e)}"
                 results.append({
                     "filename": file.name,
                     "success": False,
                     "message": error_msg
                 })
-                print(f"处理文件时出错: {file.name}, 错误: {e}")
+                logger.warning("处理文件时出错: name=%s error=%s", file.name, e)
     
     except Exception as e:
         error_msg = f"获取文件夹内容失败: {str(e)}"
@@ -347,43 +766,63 @@ def download_folder_recursive(folder_path: str, folder_name: str, video_filter:
             "success": False,
             "message": error_msg
         })
-        print(f"处理文件夹时出错: {folder_path}, 错误: {e}")
+        logger.error("处理文件夹时出错: path=%s error=%s", folder_path, e)
     
-    print(f"文件夹处理完成，结果数量: {len(results)}")
+    logger.info("文件夹处理完成: path=%s results=%d", folder_path, len(results))
     return results
 
-def get_folder_files_recursive(folder_path: str) -> List[WebDavFile]:
-    """递归获取文件夹中的所有文件"""
+def get_folder_files_recursive(webdav_client: WebDavClient, folder_path: str,
+                               file_filter: Optional[FilterChain] = None,
+                               skipped: Optional[List[Tuple[WebDavFile, str]]] = None) -> List[WebDavFile]:
+    """递归获取文件夹中的所有文件
+
+    指定file_filter时只返回符合条件的文件，不符合的文件及原因追加到skipped。
+    """
     all_files = []
     
+    with CRAWL_SECONDS.time():
+        _collect_folder_files(webdav_client, folder_path, all_files, file_filter, skipped, depth=0)
+    
+    logger.info("文件夹扫描完成: path=%s files=%d", folder_path, len(all_files))
+    return all_files
+
+def _collect_folder_files(webdav_client: WebDavClient, folder_path: str, all_files: List[WebDavFile],
+                          file_filter: Optional[FilterChain], skipped: Optional[List[Tuple[WebDavFile, str]]],
+                          depth: int):
+    """递归扫描文件夹，将文件追加到all_files"""
     try:
-        print(f"正在扫描文件夹: {folder_path}")
         files = webdav_client.list_directory(folder_path)
-        print(f"在 {folder_path} 中找到 {len(files)} 个项目")
+        CRAWL_DIRECTORIES.inc()
+        CRAWL_ENTRIES.inc(len(files))
+        logger.debug("扫描文件夹: path=%s entries=%d", folder_path, len(files))
         
         for file in files:
-            print(f"处理项目: {file.name}, 路径: {file.path}, 是否目录: {file.is_directory}")
-            
             if file.is_directory:
-                print(f"进入子文件夹: {file.path}")
+                # 目录排除规则在发出PROPFIND之前剪枝
+                if file_filter and not file_filter.should_descend(file, depth + 1):
+                    CRAWL_PRUNED.inc()
+                    logger.debug("跳过目录: path=%s", file.path)
+                    continue
                 # 递归获取子文件夹内容
-                sub_files = get_folder_files_recursive(file.path)
-                all_files.extend(sub_files)
-                print(f"从子文件夹 {file.path} 获得 {len(sub_files)} 个文件")
+                _collect_folder_files(webdav_client, file.path, all_files, file_filter, skipped, depth + 1)
+            elif file_filter:
+                reason = file_filter.check_file(file, depth + 1)
+                if reason is None:
+                    all_files.append(file)
+                else:
+                    logger.debug("跳过文件: name=%s reason=%s", file.name, reason)
+                    if skipped is not None:
+                        skipped.append((file, reason))
             else:
                 all_files.append(file)
-                print(f"添加文件: {file.name}, 大小: {file.size}")
                 
     except Exception as e:
-        print(f"递归获取文件夹内容失败: {folder_path}, 错误: {e}")
-        logger.error(f"递归获取文件夹内容失败: {e}")
-    
-    print(f"文件夹 {folder_path} 扫描完成，总共找到 {len(all_files)} 个文件")
-    return all_files
+        logger.error("递归获取文件夹内容失败: path=%s error=%s", folder_path, e)
 
 @app.get("/api/aria2/status")
-async def aria2_status():
+def aria2_status(request: Request):
     """获取Aria2状态"""
+    _, aria2_client = get_session_clients(request)
     if not aria2_client:
         return {"connected": False}
     
@@ -397,17 +836,18 @@ async def aria2_status():
         return {"connected": False}
 
 @app.get("/api/aria2/downloads")
-async def get_aria2_downloads():
+def get_aria2_downloads(request: Request):
     """获取Aria2下载列表"""
+    _, aria2_client = get_session_clients(request)
     if not aria2_client:
         raise HTTPException(status_code=400, detail="Aria2未连接")
     
     try:
         downloads = aria2_client.get_downloads()
-        return {
+        return conditional_json(request, {
             "success": True,
             "downloads": downloads
-        }
+        }, downloads)
     except Exception as e:
         return {
             "success": False,
@@ -415,8 +855,9 @@ async def get_aria2_downloads():
         }
 
 @app.post("/api/aria2/pause/{gid}")
-async def pause_download(gid: str):
+def pause_download(request: Request, gid: str):
     """暂停下载"""
+    _, aria2_client = get_session_clients(request)
     if not aria2_client:
         raise HTTPException(status_code=400, detail="Aria2未连接")
     
@@ -433,8 +874,9 @@ async def pause_download(gid: str):
         }
 
 @app.post("/api/aria2/resume/{gid}")
-async def resume_download(gid: str):
+def resume_download(request: Request, gid: str):
     """恢复下载"""
+    _, aria2_client = get_session_clients(request)
     if not aria2_client:
         raise HTTPException(status_code=400, detail="Aria2未连接")
     
@@ -451,8 +893,9 @@ async def resume_download(gid: str):
         }
 
 @app.delete("/api/aria2/remove/{gid}")
-async def remove_download(gid: str):
+def remove_download(request: Request, gid: str):
     """删除下载任务"""
+    _, aria2_client = get_session_clients(request)
     if not aria2_client:
         raise HTTPException(status_code=400, detail="Aria2未连接")
     
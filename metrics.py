@@ -0,0 +1,208 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Prometheus文本格式的Content-Type
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认桶配置
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape_label_value(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类，按标签值分组存储"""
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self._render_samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """累积直方图，兼容Prometheus的_bucket/_sum/_count输出"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # 非累积计数，渲染时再累加；最后一格为+Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文，退出时记录耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = []
+        bounds = self.buckets + (float('inf'),)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_number(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            base_labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{base_labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{base_labels} {count}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# WebDAV
+PROPFIND_SECONDS = REGISTRY.register(Histogram(
+    "w2a_webdav_propfind_seconds", "PROPFIND请求耗时（秒）", ("server",)))
+PROPFIND_RESPONSE_BYTES = REGISTRY.register(Histogram(
+    "w2a_webdav_propfind_response_bytes", "PROPFIND响应体大小（字节）", ("server",), buckets=SIZE_BUCKETS))
+XML_PARSE_SECONDS = REGISTRY.register(Histogram(
+    "w2a_webdav_xml_parse_seconds", "PROPFIND响应XML解析耗时（秒）"))
+LISTING_ENTRIES = REGISTRY.register(Histogram(
+    "w2a_webdav_listing_entries", "单次目录列表返回的条目数", buckets=COUNT_BUCKETS))
+WEBDAV_RETRIES = REGISTRY.register(Counter(
+    "w2a_webdav_retries_total", "WebDAV请求重试次数", ("server", "reason")))
+WEBDAV_REQUESTS = REGISTRY.register(Counter(
+    "w2a_webdav_requests_total", "WebDAV客户端发出的请求数（含重试）", ("server",)))
+WEBDAV_CONNECTIONS_OPENED = REGISTRY.register(Counter(
+    "w2a_webdav_connections_opened_total", "WebDAV客户端新建的连接数（HTTP/1.1）", ("server",)))
+
+# 递归扫描
+CRAWL_SECONDS = REGISTRY.register(Histogram(
+    "w2a_crawl_seconds", "一次递归扫描的总耗时（秒）", buckets=LATENCY_BUCKETS + (60.0, 120.0, 300.0)))
+CRAWL_DIRECTORIES = REGISTRY.register(Counter(
+    "w2a_crawl_directories_total", "递归扫描中列出的目录数"))
+CRAWL_ENTRIES = REGISTRY.register(Counter(
+    "w2a_crawl_entries_total", "递归扫描中发现的条目数"))
+CRAWL_PRUNED = REGISTRY.register(Counter(
+    "w2a_crawl_pruned_directories_total", "被目录排除规则剪枝、未扫描的目录数"))
+
+# Aria2
+ARIA2_RPC_SECONDS = REGISTRY.register(Histogram(
+    "w2a_aria2_rpc_seconds", "Aria2 RPC调用耗时（秒）", ("method",)))
+ARIA2_SUBMISSIONS = REGISTRY.register(Counter(
+    "w2a_aria2_submissions_total", "提交到Aria2的下载任务数", ("result",)))
+
+# HTTP接口
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "w2a_http_request_seconds", "HTTP接口处理耗时（秒）", ("method", "route", "status")))
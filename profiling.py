@@ -0,0 +1,341 @@
+import asyncio
+import hmac
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# 管理员令牌，未设置时禁用所有管理接口
+ADMIN_TOKEN_ENV = "W2A_ADMIN_TOKEN"
+
+# 单次采集窗口上限（秒）
+MAX_PROFILE_SECONDS = 300
+
+PROFILE_MODES = ("sample", "cprofile")
+
+
+class ProfilerBusyError(Exception):
+    """已有分析任务在运行"""
+
+
+# 单请求分析时只分析该请求（随请求的上下文传递），时间窗口分析时分析窗口内的所有请求
+_request_profiler: ContextVar[Optional["DeterministicProfiler"]] = ContextVar("w2a_request_profiler", default=None)
+_window_profiler: Optional["DeterministicProfiler"] = None
+
+
+def active_profiler() -> Optional["DeterministicProfiler"]:
+    """当前请求应使用的cProfile分析器"""
+    return _request_profiler.get() or _window_profiler
+
+
+def check_admin_token(token: Optional[str]) -> bool:
+    """校验管理员令牌"""
+    expected = os.environ.get(ADMIN_TOKEN_ENV, "")
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(expected.encode(), token.encode())
+
+
+def _frame_label(code) -> str:
+    filename = os.path.basename(code.co_filename)
+    return f"{filename}:{code.co_name}:{code.co_firstlineno}"
+
+
+class SamplingProfiler:
+    """采样分析器：后台线程定时抓取所有线程的调用栈，统计折叠栈"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="w2a-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, str(ident)))
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """flamegraph.pl / speedscope兼容的折叠栈文本"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class DeterministicProfiler:
+    """确定性分析器：在执行接口函数的线程中启用cProfile
+
+    访问WebDAV/Aria2的接口在线程池中执行，只分析事件循环线程看不到这些调用，因此由
+    ProfiledRoute在接口函数所在的线程中逐次启用cProfile并合并结果。同一时间只分析一次调用
+    （Python 3.12起cProfile只能有一个实例处于启用状态），并发的其他调用不分析，计入skipped_calls。
+    """
+
+    def __init__(self):
+        import cProfile
+        import pstats
+        self._cprofile = cProfile
+        self._pstats = pstats
+        self._merged = None
+        self._active = False
+        self._busy = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self.calls = 0
+        self.skipped_calls = 0
+
+    def start(self):
+        self._active = True
+
+    def stop(self):
+        # 仍在执行的调用结束后不再合并，结果只包含停止前完成的调用
+        with self._merge_lock:
+            self._active = False
+
+    def _enter(self) -> bool:
+        if not self._active:
+            return False
+        if not self._busy.acquire(blocking=False):
+            self.skipped_calls += 1
+            return False
+        return True
+
+    def _merge(self, profile):
+        self._busy.release()
+        with self._merge_lock:
+            if not self._active:
+                return
+            if self._merged is None:
+                self._merged = self._pstats.Stats(profile, stream=io.StringIO())
+            else:
+                self._merged.add(profile)
+            self.calls += 1
+
+    def profile_call(self, func, /, **kwargs):
+        """在当前线程中分析一次同步调用"""
+        if not self._enter():
+            return func(**kwargs)
+        profile = self._cprofile.Profile()
+        try:
+            return profile.runcall(func, **kwargs)
+        finally:
+            self._merge(profile)
+
+    async def profile_async(self, func, /, **kwargs):
+        """在事件循环线程中分析一次协程调用（期间其他任务的执行也会计入）"""
+        if not self._enter():
+            return await func(**kwargs)
+        profile = self._cprofile.Profile()
+        profile.enable()
+        try:
+            return await func(**kwargs)
+        finally:
+            profile.disable()
+            self._merge(profile)
+
+    def _stats(self):
+        with self._merge_lock:
+            return self._merged or self._pstats.Stats(stream=io.StringIO())
+
+    def collapsed(self) -> str:
+        """按调用边输出折叠栈（caller;callee），权重为函数自身耗时（微秒）
+
+        cProfile只记录调用边而非完整调用栈，火焰图深度因此为两层。
+        """
+        stats = self._stats().stats
+        lines = []
+        for func, (_, _, tt, _, callers) in stats.items():
+            callee = f"{os.path.basename(func[0])}:{func[2]}:{func[1]}"
+            if not callers:
+                # 分析开始时已在栈上的函数没有调用方记录
+                weight = int(tt * 1_000_000)
+                if weight > 0:
+                    lines.append((weight, f"{callee} {weight}"))
+                continue
+            for caller, caller_stats in callers.items():
+                inline_time = caller_stats[2]
+                weight = int(inline_time * 1_000_000)
+                if weight <= 0:
+                    continue
+                caller_label = f"{os.path.basename(caller[0])}:{caller[2]}:{caller[1]}"
+                lines.append((weight, f"{caller_label};{callee} {weight}"))
+        lines.sort(reverse=True)
+        return "\n".join(line for _, line in lines)
+
+    def top_functions(self, limit: int) -> List[Dict[str, Any]]:
+        """按累计耗时排序的热点函数"""
+        stats = self._stats().stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [{
+            "function": f"{os.path.basename(func[0])}:{func[2]}:{func[1]}",
+            "calls": nc,
+            "self_seconds": round(tt, 6),
+            "cumulative_seconds": round(ct, 6),
+        } for func, (_, nc, tt, ct, _) in rows]
+
+
+class AllocationTracker:
+    """使用tracemalloc统计窗口内的内存分配热点"""
+
+    def __init__(self):
+        import tracemalloc
+        self._tracemalloc = tracemalloc
+        self._started_here = False
+
+    def start(self):
+        if not self._tracemalloc.is_tracing():
+            self._tracemalloc.start()
+            self._started_here = True
+
+    def cancel(self):
+        """停止由本次分析启动的tracemalloc，不生成结果"""
+        if self._started_here:
+            self._tracemalloc.stop()
+            self._started_here = False
+
+    def stop(self, limit: int) -> List[Dict[str, Any]]:
+        tracemalloc = self._tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        if self._started_here:
+            tracemalloc.stop()
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            # 分析器自身的分配（如采样线程的折叠栈计数）
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        return [{
+            "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_bytes": stat.size,
+            "count": stat.count,
+        } for stat in snapshot.statistics("lineno")[:limit]]
+
+
+class ProfileSession:
+    """一次分析会话（采样或cProfile + tracemalloc）"""
+
+    _lock = threading.Lock()
+
+    def __init__(self, mode: str = "sample", interval: float = 0.01, trace_allocations: bool = True,
+                 single_request: bool = False):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"不支持的分析模式: {mode}")
+        self.mode = mode
+        self.profiler = SamplingProfiler(interval) if mode == "sample" else DeterministicProfiler()
+        self.allocations = AllocationTracker() if trace_allocations else None
+        self.single_request = single_request
+        self._started_at = 0.0
+        self._token = None
+
+    def _activate(self):
+        global _window_profiler
+        if not isinstance(self.profiler, DeterministicProfiler):
+            return
+        if self.single_request:
+            self._token = _request_profiler.set(self.profiler)
+        else:
+            _window_profiler = self.profiler
+
+    def _deactivate(self):
+        global _window_profiler
+        if self._token is not None:
+            _request_profiler.reset(self._token)
+            self._token = None
+        elif _window_profiler is self.profiler:
+            _window_profiler = None
+
+    def start(self):
+        # 同一时间只允许一个分析会话，避免互相干扰
+        if not ProfileSession._lock.acquire(blocking=False):
+            raise ProfilerBusyError("已有分析任务在运行")
+        try:
+            self._started_at = time.perf_counter()
+            if self.allocations:
+                self.allocations.start()
+            self.profiler.start()
+            self._activate()
+        except Exception:
+            # 启动失败时恢复状态并释放锁，否则之后的分析请求都会返回409
+            if self.allocations:
+                self.allocations.cancel()
+            ProfileSession._lock.release()
+            raise
+        logger.info("开始性能分析: mode=%s", self.mode)
+
+    def stop(self, top: int = 30) -> Dict[str, Any]:
+        try:
+            self._deactivate()
+            self.profiler.stop()
+            duration = time.perf_counter() - self._started_at
+            result = {
+                "mode": self.mode,
+                "duration_seconds": round(duration, 3),
+                "collapsed": self.profiler.collapsed(),
+                "allocations": self.allocations.stop(top) if self.allocations else [],
+            }
+            if isinstance(self.profiler, SamplingProfiler):
+                result["samples"] = self.profiler.samples
+            else:
+                result["top_functions"] = self.profiler.top_functions(top)
+                result["profiled_calls"] = self.profiler.calls
+                result["skipped_calls"] = self.profiler.skipped_calls
+            logger.info("性能分析结束: mode=%s duration=%.3fs", self.mode, duration)
+            return result
+        finally:
+            ProfileSession._lock.release()
+
+
+def _profiled_endpoint(call):
+    """包装接口函数：存在cProfile分析器时在实际执行接口的线程中分析
+
+    同步接口由这里放入线程池执行（与FastAPI默认行为相同），分析器在工作线程内启用。
+    """
+    if asyncio.iscoroutinefunction(call):
+        async def endpoint(**values):
+            profiler = active_profiler()
+            if profiler is None:
+                return await call(**values)
+            return await profiler.profile_async(call, **values)
+    else:
+        async def endpoint(**values):
+            profiler = active_profiler()
+            if profiler is None:
+                return await run_in_threadpool(call, **values)
+            return await run_in_threadpool(profiler.profile_call, call, **values)
+    return endpoint
+
+
+class ProfiledRoute(APIRoute):
+    """支持mode=cprofile的路由，需在注册接口前设置为app.router.route_class"""
+
+    def get_route_handler(self):
+        self.dependant.call = _profiled_endpoint(self.dependant.call)
+        return super().get_route_handler()
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import os
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import CRAWL_DIRECTORIES, CRAWL_ENTRIES
+from state_store import StateStore
+from webdav_client import WebDavClient, WebDavFile
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAMESPACE = "rollup"
+
+# 汇总缓存的有效期（秒）：很多WebDAV服务器只在直接子项变化时更新目录的ETag/修改时间，
+# 深层变化依赖过期时间兜底
+ROLLUP_TTL = float(os.environ.get("W2A_ROLLUP_TTL", 3600))
+
+# 并行扫描的线程数
+CRAWL_WORKERS = int(os.environ.get("W2A_CRAWL_WORKERS", 8))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_crawl_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=CRAWL_WORKERS, thread_name_prefix="w2a-crawl")
+    return _executor
+
+
+@dataclass
+class FolderRollup:
+    """目录的递归汇总"""
+    validator: str
+    size: int = 0
+    file_count: int = 0
+    directory_count: int = 0
+    video_size: int = 0
+    # 列出失败的目录数；不为0时汇总不完整，不写入缓存
+    failed_directories: int = 0
+
+
+def directory_validator(directory: WebDavFile) -> str:
+    """目录的版本标识：ETag和修改时间"""
+    return f"{directory.etag}|{directory.modified}"
+
+
+class RollupCache:
+    """按目录缓存汇总结果，缓存键包含服务器、账号和视频大小阈值"""
+
+    def __init__(self, store: StateStore, client: WebDavClient, video_min_size: int):
+        self.store = store
+        self._prefix = f"{client.base_url}|{client.username}|{video_min_size}|"
+
+    def _key(self, path: str) -> str:
+        return hashlib.sha1((self._prefix + path.rstrip('/')).encode()).hexdigest()
+
+    def get(self, path: str, validator: str) -> Optional[FolderRollup]:
+        value = self.store.get(ROLLUP_NAMESPACE, self._key(path))
+        if value is None or value["validator"] != validator:
+            return None
+        return FolderRollup(**value)
+
+    def set(self, path: str, rollup: FolderRollup):
+        self.store.set(ROLLUP_NAMESPACE, self._key(path), asdict(rollup), ttl=ROLLUP_TTL)
+
+    def invalidate(self, path: str):
+        self.store.delete(ROLLUP_NAMESPACE, self._key(path))
+
+
+def compute_folder_rollup(client: WebDavClient, path: str, cache: RollupCache,
+                          is_video: Callable[[WebDavFile], bool],
+                          refresh: bool = False) -> Tuple[FolderRollup, bool]:
+    """计算目录的递归大小和文件数，返回 (汇总, 是否完全来自缓存)
+
+    按层并行列出目录；子目录的ETag/修改时间与缓存一致时直接复用缓存，
+    不再扫描其子树。汇总结果自底向上逐目录写回缓存；列出失败的目录及其上级目录的
+    汇总不完整，不写入缓存。起始目录本身列出失败时抛出异常。
+    """
+    root = client.stat(path)
+    # 无法获取起始目录的版本标识时既不读取也不写入其缓存，以免命中过期的汇总
+    root_validator = directory_validator(root) if root else None
+    if refresh or root_validator is None:
+        cache.invalidate(path)
+    else:
+        cached = cache.get(path, root_validator)
+        if cached:
+            return cached, True
+
+    started = time.perf_counter()
+    executor = get_crawl_executor()
+
+    # 每个已扫描目录：(版本标识, 直接文件的汇总, 子目录路径列表)
+    scanned: Dict[str, Tuple[str, FolderRollup, List[str]]] = {}
+    failed: Set[str] = set()
+    reused: Dict[str, FolderRollup] = {}
+    order: List[str] = []
+    frontier: List[Tuple[str, str]] = [(path, root_validator or "")]
+
+    while frontier:
+        futures = {executor.submit(client.list_directory, p, True): (p, v) for p, v in frontier}
+        frontier = []
+        for future in as_completed(futures):
+            directory_path, validator = futures[future]
+            try:
+                entries = future.result()
+            except Exception as e:
+                if directory_path == path:
+                    raise
+                logger.error("目录汇总时列出目录失败: path=%s error=%s", directory_path, e)
+                failed.add(directory_path)
+                entries = []
+            CRAWL_DIRECTORIES.inc()
+            CRAWL_ENTRIES.inc(len(entries))
+
+            own = FolderRollup(validator=validator)
+            subdirs = []
+            for entry in entries:
+                if entry.is_directory:
+                    subdirs.append(entry.path)
+                    child_validator = directory_validator(entry)
+                    cached = None if refresh else cache.get(entry.path, child_validator)
+                    if cached:
+                        reused[entry.path] = cached
+                    else:
+                        frontier.append((entry.path, child_validator))
+                else:
+                    own.size += entry.size
+                    own.file_count += 1
+                    if is_video(entry):
+                        own.video_size += entry.size
+            scanned[directory_path] = (validator, own, subdirs)
+            order.append(directory_path)
+
+    # 自底向上汇总（order为按层顺序，逆序即先处理最深的目录）
+    totals: Dict[str, FolderRollup] = dict(reused)
+    for directory_path in reversed(order):
+        validator, own, subdirs = scanned[directory_path]
+        rollup = FolderRollup(validator=validator, size=own.size, file_count=own.file_count,
+                              video_size=own.video_size,
+                              failed_directories=1 if directory_path in failed else 0)
+        for subdir in subdirs:
+            child = totals.get(subdir)
+            if child is None:
+                continue
+            rollup.size += child.size
+            rollup.file_count += child.file_count
+            rollup.video_size += child.video_size
+            rollup.directory_count += child.directory_count + 1
+            rollup.failed_directories += child.failed_directories
+        totals[directory_path] = rollup
+        if directory_path == path and root_validator is None:
+            continue
+        if not rollup.failed_directories:
+            cache.set(directory_path, rollup)
+
+    # 上级目录的缓存包含该子树的旧数据，一并失效
+    if path.rstrip('/'):
+        parent = posixpath.dirname(path.rstrip('/'))
+        while parent and parent != '/':
+            cache.invalidate(parent)
+            parent = posixpath.dirname(parent)
+        cache.invalidate('/')
+
+    logger.info("目录汇总完成: path=%s scanned=%d reused=%d failed=%d elapsed=%.3fs",
+                path, len(scanned), len(reused), len(failed), time.perf_counter() - started)
+    return totals[path], False
@@ -0,0 +1,282 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from webdav_client import WebDavClient, Aria2Client, TransportConfig
+from state_store import StateStore, MemoryStateStore
+
+logger = logging.getLogger(__name__)
+
+# 浏览器会话Cookie和API令牌请求头
+SESSION_COOKIE = "w2a_session"
+API_TOKEN_HEADER = "X-API-Token"
+
+# 状态存储中的命名空间
+WEBDAV_CONFIG_NAMESPACE = "webdav_config"
+ARIA2_CONFIG_NAMESPACE = "aria2_config"
+
+
+# 服务内部使用的会话ID前缀；浏览器会话ID只含URL安全的base64字符，不可能带有冒号
+INTERNAL_SESSION_PREFIX = "internal:"
+
+# new_session_id()生成的会话ID格式
+_SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{32}$')
+
+
+class PinnedSessionError(Exception):
+    """试图修改启动配置的固定会话"""
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def is_valid_session_id(value: str) -> bool:
+    """Cookie中的会话ID是否为new_session_id()生成的格式"""
+    return bool(value) and _SESSION_ID_PATTERN.match(value) is not None
+
+
+def session_id_for_token(token: str) -> str:
+    """API令牌映射为会话ID，避免在内存中以明文令牌作为键"""
+    return "token:" + hashlib.sha256(token.encode()).hexdigest()
+
+
+@dataclass
+class ClientSession:
+    """单个会话持有的WebDAV/Aria2客户端"""
+    session_id: str
+    webdav_client: Optional[WebDavClient] = None
+    aria2_client: Optional[Aria2Client] = None
+    last_used: float = field(default_factory=time.monotonic)
+    # 本地客户端对应的配置版本，与状态存储不一致时重建
+    webdav_version: str = ""
+    aria2_version: str = ""
+    persisted_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def connection_budget(self) -> int:
+        """该会话WebDAV连接池最多占用的连接数"""
+        return self.webdav_client.transport.pool_maxsize if self.webdav_client else 0
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.webdav_client:
+            self.webdav_client.close()
+        self.webdav_client = None
+        self.aria2_client = None
+        self.webdav_version = ""
+        self.aria2_version = ""
+
+
+class SessionRegistry:
+    """按浏览器会话或API令牌隔离的客户端注册表
+
+    每个会话持有独立的连接池；空闲超时的会话被回收，所有会话的
+    WebDAV连接池容量之和不超过max_connections。
+
+    连接配置保存在共享的状态存储中，客户端（连接池）则是每个进程本地的：
+    请求落到没有该会话客户端的worker上时，按存储中的配置重建。
+    """
+
+    def __init__(self, idle_timeout: float = 1800, max_connections: int = 256,
+                 store: Optional[StateStore] = None):
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.store = store or MemoryStateStore()
+        self._sessions: Dict[str, ClientSession] = {}
+        # 固定会话（启动配置的连接）不会因空闲或连接数超限被回收，配置也不过期
+        self._pinned: Set[str] = set()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls, store: Optional[StateStore] = None) -> "SessionRegistry":
+        return cls(
+            idle_timeout=float(os.environ.get("W2A_SESSION_IDLE_TIMEOUT", 1800)),
+            max_connections=int(os.environ.get("W2A_MAX_CONNECTIONS", 256)),
+            store=store
+        )
+
+    def get(self, session_id: str) -> Optional[ClientSession]:
+        with self._lock:
+            session = self._sync(session_id)
+            if session:
+                session.touch()
+                self._refresh_ttl(session)
+            return session
+
+    def _sync(self, session_id: str) -> Optional[ClientSession]:
+        """使本地客户端与状态存储中的连接配置保持一致"""
+        session = self._sessions.get(session_id)
+        webdav_config = self.store.get(WEBDAV_CONFIG_NAMESPACE, session_id)
+        aria2_config = self.store.get(ARIA2_CONFIG_NAMESPACE, session_id)
+        if webdav_config is None and aria2_config is None:
+            # 已在其他worker断开或已过期
+            if session:
+                self._remove_local(session_id, reason="配置已失效")
+            return None
+
+        if session is None:
+            session = self._sessions[session_id] = ClientSession(session_id)
+
+        if webdav_config is None:
+            if session.webdav_client:
+                session.webdav_client.close()
+            session.webdav_client, session.webdav_version = None, ""
+        elif webdav_config["version"] != session.webdav_version:
+            self._build_webdav(session, webdav_config)
+
+        if aria2_config is None:
+            session.aria2_client, session.aria2_version = None, ""
+        elif aria2_config["version"] != session.aria2_version:
+            session.aria2_client = Aria2Client(aria2_config["url"], aria2_config["secret"])
+            session.aria2_version = aria2_config["version"]
+        return session
+
+    def _build_webdav(self, session: ClientSession, config: Dict, transport: Optional[TransportConfig] = None):
+        transport = transport or TransportConfig.from_env()
+        # 先刷新使用时间，避免在预留连接时被当作空闲会话回收
+        session.touch()
+        if session.webdav_client:
+            session.webdav_client.close()
+            session.webdav_client = None
+        pool_size = self._reserve_connections(transport.pool_maxsize, exclude=session.session_id)
+        session.webdav_client = WebDavClient(
+            config["url"], config["username"], config["password"],
+            transport=dataclasses.replace(transport, pool_maxsize=pool_size)
+        )
+        session.webdav_version = config["version"]
+
+    def _refresh_ttl(self, session: ClientSession):
+        """延长存储中配置的过期时间；限制写入频率，避免每个请求都写存储"""
+        now = time.monotonic()
+        if session.session_id in self._pinned or now - session.persisted_at < self.idle_timeout / 10:
+            return
+        session.persisted_at = now
+        self.store.touch(WEBDAV_CONFIG_NAMESPACE, session.session_id, self.idle_timeout)
+        self.store.touch(ARIA2_CONFIG_NAMESPACE, session.session_id, self.idle_timeout)
+
+    def get_or_create(self, session_id: str) -> ClientSession:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = ClientSession(session_id)
+            session.touch()
+            return session
+
+    def sessions(self) -> List[ClientSession]:
+        with self._lock:
+            return list(self._sessions.values())
+
+    def _config_version(self, config: Dict, pinned: bool) -> str:
+        """配置版本：普通连接每次随机生成（重新连接即重建客户端）；
+        固定会话由配置内容决定，各worker启动时写入相同版本，不会互相触发重建
+        """
+        if not pinned:
+            return secrets.token_hex(8)
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+    def _pin(self, session_id: str, pinned: bool):
+        """固定会话只能由启动配置（pinned=True）重新连接，不能被普通连接请求覆盖或解除固定"""
+        if pinned:
+            self._pinned.add(session_id)
+        elif session_id in self._pinned:
+            raise PinnedSessionError("启动配置的连接不能在会话中修改")
+
+    def connect_webdav(self, session_id: str, base_url: str, username: str = "", password: str = "",
+                       transport: Optional[TransportConfig] = None, pinned: bool = False) -> WebDavClient:
+        """为会话创建新的WebDAV客户端，替换该会话原有的客户端"""
+        config = {"url": base_url, "username": username, "password": password}
+        config["version"] = self._config_version(config, pinned)
+        with self._lock:
+            self._pin(session_id, pinned)
+            session = self.get_or_create(session_id)
+            self._build_webdav(session, config, transport)
+            self.store.set(WEBDAV_CONFIG_NAMESPACE, session_id, config, ttl=None if pinned else self.idle_timeout)
+            session.persisted_at = time.monotonic()
+            return session.webdav_client
+
+    def connect_aria2(self, session_id: str, rpc_url: str, secret: str = "", pinned: bool = False) -> Aria2Client:
+        """为会话创建新的Aria2客户端"""
+        config = {"url": rpc_url, "secret": secret}
+        config["version"] = self._config_version(config, pinned)
+        client = Aria2Client(rpc_url, secret)
+        with self._lock:
+            self._pin(session_id, pinned)
+            session = self.get_or_create(session_id)
+            session.aria2_client, session.aria2_version = client, config["version"]
+            self.store.set(ARIA2_CONFIG_NAMESPACE, session_id, config, ttl=None if pinned else self.idle_timeout)
+            session.persisted_at = time.monotonic()
+        return client
+
+    def _reserve_connections(self, wanted: int, exclude: str) -> int:
+        """确保总连接数不超上限：先回收空闲会话，再按最近最少使用淘汰，最后缩小连接池"""
+        self.evict_idle()
+        in_use = sum(s.connection_budget for s in self._sessions.values())
+        if in_use + wanted > self.max_connections:
+            candidates = sorted(
+                (s for s in self._sessions.values()
+                 if s.session_id != exclude and s.session_id not in self._pinned and s.webdav_client),
+                key=lambda s: s.last_used
+            )
+            for session in candidates:
+                if in_use + wanted <= self.max_connections:
+                    break
+                in_use -= session.connection_budget
+                self._remove_local(session.session_id, reason="连接数超限")
+        return max(1, min(wanted, self.max_connections - in_use))
+
+    def evict_idle(self) -> int:
+        """回收本进程中空闲超时的会话，返回回收数量
+
+        只关闭本地连接池；存储中的配置由过期时间控制，其他worker仍在使用时不受影响。
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            expired = [sid for sid, s in self._sessions.items()
+                       if s.last_used < deadline and sid not in self._pinned]
+            for session_id in expired:
+                self._remove_local(session_id, reason="空闲超时")
+        self.store.purge_expired()
+        return len(expired)
+
+    def remove(self, session_id: str):
+        """断开会话，所有worker上的客户端都会失效"""
+        with self._lock:
+            if session_id in self._pinned:
+                raise PinnedSessionError("启动配置的连接不能在会话中断开")
+            self.store.delete(WEBDAV_CONFIG_NAMESPACE, session_id)
+            self.store.delete(ARIA2_CONFIG_NAMESPACE, session_id)
+            self._remove_local(session_id, reason="主动断开")
+
+    def _remove_local(self, session_id: str, reason: str):
+        session = self._sessions.pop(session_id, None)
+        if session:
+            session.close()
+            logger.info("回收会话: session=%s reason=%s", session_id[:8], reason)
+
+    def close_all(self):
+        with self._lock:
+            for session_id in list(self._sessions):
+                self._remove_local(session_id, reason="服务关闭")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "webdav_sessions": sum(1 for s in self._sessions.values() if s.webdav_client),
+                "aria2_sessions": sum(1 for s in self._sessions.values() if s.aria2_client),
+                "pinned_sessions": len(self._pinned),
+                "connection_budget_in_use": sum(s.connection_budget for s in self._sessions.values()),
+                "max_connections": self.max_connections,
+                "idle_timeout": self.idle_timeout
+            }
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+from sessions import SessionRegistry, session_id_for_token, INTERNAL_SESSION_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 启动配置文件（JSON），环境变量中的同名配置优先
+CONFIG_ENV = "W2A_CONFIG"
+
+# 未设置api_token时，启动配置的连接保存在该会话中，作为所有会话的默认连接
+PRECONFIGURED_SESSION_ID = INTERNAL_SESSION_PREFIX + "preconfigured"
+
+# 预热失败后的重试间隔（秒），逐次翻倍
+RETRY_INITIAL_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+# 组件状态
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+@dataclass
+class StartupConfig:
+    """启动时建立的WebDAV/Aria2连接"""
+    webdav_url: str = ""
+    webdav_username: str = ""
+    webdav_password: str = ""
+    aria2_url: str = ""
+    aria2_secret: str = ""
+    api_token: str = ""
+    prewarm_connections: int = 4
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "StartupConfig":
+        """读取配置文件和W2A_WEBDAV_URL等环境变量
+
+        配置文件格式：
+            {"webdav": {"url": "...", "username": "...", "password": "..."},
+             "aria2": {"url": "...", "secret": "..."},
+             "api_token": "...", "prewarm_connections": 4}
+        """
+        data = {}
+        path = path or os.environ.get(CONFIG_ENV)
+        if path:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            logger.info(f"读取启动配置: {path}")
+        webdav = data.get("webdav") or {}
+        aria2 = data.get("aria2") or {}
+
+        def env(name: str, default):
+            value = os.environ.get(name)
+            return default if value is None or value == "" else value
+
+        return cls(
+            webdav_url=env("W2A_WEBDAV_URL", webdav.get("url", "")),
+            webdav_username=env("W2A_WEBDAV_USERNAME", webdav.get("username", "")),
+            webdav_password=env("W2A_WEBDAV_PASSWORD", webdav.get("password", "")),
+            aria2_url=env("W2A_ARIA2_URL", aria2.get("url", "")),
+            aria2_secret=env("W2A_ARIA2_SECRET", aria2.get("secret", "")),
+            api_token=env("W2A_API_TOKEN", data.get("api_token", "")),
+            prewarm_connections=int(env("W2A_PREWARM_CONNECTIONS", data.get("prewarm_connections", 4)))
+        )
+
+    @property
+    def session_id(self) -> str:
+        """设置了api_token时连接只属于持有该令牌的请求，否则作为默认连接"""
+        return session_id_for_token(self.api_token) if self.api_token else PRECONFIGURED_SESSION_ID
+
+    @property
+    def is_default(self) -> bool:
+        """未连接的会话是否回退使用启动配置的连接"""
+        return bool(self.webdav_url or self.aria2_url) and not self.api_token
+
+
+@dataclass
+class ComponentStatus:
+    state: str = PENDING
+    attempts: int = 0
+    error: str = ""
+    ready_after: Optional[float] = None   # 进程启动到就绪的秒数
+
+
+class Readiness:
+    """就绪状态：所有启动配置的连接都已预热时就绪"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.components: Dict[str, ComponentStatus] = {}
+
+    def register(self, name: str):
+        self.components[name] = ComponentStatus()
+
+    def update(self, name: str, state: str, error: str = ""):
+        status = self.components[name]
+        status.state = state
+        status.error = error
+        if state == WARMING:
+            status.attempts += 1
+        elif state == READY:
+            status.ready_after = round(time.monotonic() - self.started, 3)
+
+    @property
+    def ready(self) -> bool:
+        return all(status.state == READY for status in self.components.values())
+
+    def snapshot(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "uptime": round(time.monotonic() - self.started, 3),
+            "components": {name: asdict(status) for name, status in self.components.items()}
+        }
+
+
+class Prewarmer:
+    """在后台按启动配置建立连接并预热连接池，失败时退避重试直至成功"""
+
+    def __init__(self, registry: SessionRegistry, config: StartupConfig, readiness: Readiness):
+        self.registry = registry
+        self.config = config
+        self.readiness = readiness
+
+    def start(self) -> List[asyncio.Task]:
+        tasks = []
+        if self.config.webdav_url:
+            tasks.append(self._spawn("webdav", self._connect_webdav))
+        if self.config.aria2_url:
+            tasks.append(self._spawn("aria2", self._connect_aria2))
+        return tasks
+
+    def _spawn(self, name: str, connect) -> asyncio.Task:
+        self.readiness.register(name)
+        return asyncio.create_task(self._warm(name, connect))
+
+    async def _warm(self, name: str, connect):
+        delay = RETRY_INITIAL_DELAY
+        while True:
+            self.readiness.update(name, WARMING)
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(connect)
+            except Exception as e:
+                self.readiness.update(name, FAILED, str(e))
+                logger.warning(f"预热失败，{delay:.0f}秒后重试: component={name} error={e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+                continue
+            self.readiness.update(name, READY)
+            logger.info(f"预热完成: component={name} elapsed={time.perf_counter() - started:.3f}s")
+            return
+
+    def _connect_webdav(self):
+        client = self.registry.connect_webdav(
+            self.config.session_id, self.config.webdav_url,
+            self.config.webdav_username, self.config.webdav_password, pinned=True
+        )
+        client.warm_up(self.config.prewarm_connections)
+
+    def _connect_aria2(self):
+        client = self.registry.connect_aria2(
+            self.config.session_id, self.config.aria2_url, self.config.aria2_secret, pinned=True
+        )
+        if not client.test_connection():
+            raise ConnectionError("Aria2连接测试失败")
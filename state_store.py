@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 状态存储地址，例如 memory:// 或 sqlite:////var/lib/w2a/state.db
+STATE_STORE_ENV = "W2A_STATE_STORE"
+
+
+class StateStore:
+    """按命名空间划分的键值存储，值须可JSON序列化
+
+    连接配置、任务状态和缓存都放在这里，使多个worker进程看到一致的状态。
+    """
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def touch(self, namespace: str, key: str, ttl: float):
+        """延长键的过期时间"""
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """清理过期键，返回清理数量"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """进程内存储，仅适用于单worker部署"""
+
+    def __init__(self):
+        self._data: Dict[Tuple[str, str], Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._data[(namespace, key)]
+                return None
+            return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        # 与SQLite后端保持一致：存入的是值的副本
+        value = json.loads(json.dumps(value))
+        with self._lock:
+            self._data[(namespace, key)] = (value, expires_at)
+
+    def touch(self, namespace: str, key: str, ttl: float):
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is not None:
+                self._data[(namespace, key)] = (entry[0], time.time() + ttl)
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entries = [(k, v) for (ns, k), (v, expires_at) in self._data.items()
+                       if ns == namespace and (expires_at is None or expires_at >= now)]
+        return iter(entries)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (_, expires_at) in self._data.items() if expires_at is not None and expires_at < now]
+            for k in expired:
+                del self._data[k]
+        return len(expired)
+
+
+class SQLiteStateStore(StateStore):
+    """基于SQLite（WAL模式）的存储，可在同一台机器的多个worker进程间共享
+
+    数据库放在 /dev/shm 等tmpfs上时即为共享内存存储，重启后清空。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # 存储中包含连接凭据，仅允许当前用户读写。须在连接前创建数据库文件：
+        # SQLite按数据库文件的权限创建-wal/-shm文件，而WAL中含有明文凭据
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+        for file_path in (path, path + "-wal", path + "-shm"):
+            try:
+                os.chmod(file_path, 0o600)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"无法设置状态存储文件权限: {file_path}: {e}")
+
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connection().execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+        )
+
+    def touch(self, namespace: str, key: str, ttl: float):
+        self._connection().execute(
+            "UPDATE kv SET expires_at = ? WHERE namespace = ? AND key = ?",
+            (time.time() + ttl, namespace, key)
+        )
+
+    def delete(self, namespace: str, key: str):
+        self._connection().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT key, value FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (namespace, time.time())
+        )
+        for key, value in rows:
+            yield key, json.loads(value)
+
+    def purge_expired(self) -> int:
+        cursor = self._connection().execute(
+            "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+        )
+        return cursor.rowcount
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_state_store(url: Optional[str] = None) -> StateStore:
+    """根据地址创建存储：memory://（默认）或 sqlite:///相对路径、sqlite:////绝对路径"""
+    url = url or os.environ.get(STATE_STORE_ENV) or "memory://"
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryStateStore()
+    if parsed.scheme == "sqlite":
+        path = parsed.path[1:] if parsed.path.startswith('/') else parsed.path
+        if not path:
+            raise ValueError(f"SQLite状态存储缺少数据库路径: {url}")
+        logger.info(f"使用SQLite状态存储: {path}")
+        return SQLiteStateStore(path)
+    raise ValueError(f"不支持的状态存储: {url}")
@@ -272,7 +272,13 @@ function createFileRow(file) {
         icon = '<i class="bi bi-file-earmark file-icon file-icon-default"></i>';
     }
     
-    const size = file.is_directory ? '-' : formatFileSize(file.size || 0);
+    // 目录大小仅在服务端已有汇总缓存时显示
+    let size;
+    if (file.is_directory) {
+        size = file.rollup ? `<span title="${file.rollup.file_count} 个文件">${formatFileSize(file.size || 0)}</span>` : '-';
+    } else {
+        size = formatFileSize(file.size || 0);
+    }
     
     // 为大视频文件添加特殊样式
     const videoClass = isLargeVideo ? 'large-video-file' : '';
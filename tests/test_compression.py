@@ -0,0 +1,47 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.fake_servers import FakeWebDavServer, TreeSpec
+from metrics import HTTP_REQUEST_SECONDS
+
+
+@pytest.fixture
+def client():
+    import main
+
+    server = FakeWebDavServer(TreeSpec(fanout=2, depth=1, files_per_dir=40)).start()
+    try:
+        with TestClient(main.app) as test_client:
+            response = test_client.post("/api/connect/webdav", data={"webdav_url": server.url})
+            assert response.json()["success"]
+            yield test_client
+    finally:
+        server.stop()
+
+
+def _request_count(status: str) -> int:
+    state = HTTP_REQUEST_SECONDS._values.get(("GET", "/api/files", status))
+    return state[2] if state else 0
+
+
+def test_compressed_etag_revalidates(client):
+    response = client.get("/api/files", params={"path": "/"}, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    etag = response.headers["etag"]
+    assert etag.endswith('-gzip"')
+
+    cached = client.get("/api/files", params={"path": "/"},
+                        headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert cached.status_code == 304
+
+
+def test_not_modified_keeps_route_label(client):
+    etag = client.get("/api/files", params={"path": "/"}, headers={"Accept-Encoding": "gzip"}).headers["etag"]
+    before = _request_count("304")
+
+    response = client.get("/api/files", params={"path": "/"},
+                          headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert _request_count("304") == before + 1
+    assert HTTP_REQUEST_SECONDS._values.get(("GET", "unmatched", "304")) is None
@@ -0,0 +1,104 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from filters import FilterChain, FilterRuleError, compile_rules
+from webdav_client import WebDavFile
+
+
+def make_file(path, size=0, modified=""):
+    return WebDavFile(name=path.rstrip('/').rsplit('/', 1)[-1], path=path,
+                      is_directory=path.endswith('/'), size=size, modified=modified)
+
+
+def test_include_and_exclude_globs():
+    file_filter = compile_rules("include *.mkv\ninclude *.MP4\nexclude *sample*")
+    assert file_filter.match_file(make_file("/电影/a.mkv"), 1)
+    assert file_filter.match_file(make_file("/电影/b.mp4"), 1)
+    assert file_filter.check_file(make_file("/电影/a.nfo"), 1) == "未匹配包含规则"
+    assert file_filter.check_file(make_file("/电影/a-sample.mkv"), 1) == "匹配排除规则"
+
+
+def test_path_glob_matches_full_path():
+    file_filter = compile_rules(["include /电影/*.mkv"])
+    assert file_filter.match_file(make_file("/电影/a.mkv"), 1)
+    assert not file_filter.match_file(make_file("/剧集/a.mkv"), 1)
+
+
+def test_regex_rules_are_searched_on_path():
+    file_filter = compile_rules(["include re:/电影/.*\\.mp4$"])
+    assert file_filter.match_file(make_file("/library/电影/x.MP4"), 2)
+    assert not file_filter.match_file(make_file("/library/电影/x.mp4.part"), 2)
+
+
+def test_regex_inline_flags_compile():
+    file_filter = compile_rules(["include re:(?i)foo", "include re:bar$"])
+    assert file_filter.match_file(make_file("/FOO.mkv"), 1)
+    assert file_filter.match_file(make_file("/x.bar"), 1)
+
+
+def test_regex_backreferences_are_not_renumbered():
+    file_filter = compile_rules(["include re:(a)x", "include re:(b)\\1"])
+    assert file_filter.match_file(make_file("/bb"), 1)
+    assert not file_filter.match_file(make_file("/bc"), 1)
+
+
+def test_exclude_dir_prunes_subtree():
+    file_filter = compile_rules(["exclude-dir Sample", "exclude-dir re:/tmp$"])
+    assert not file_filter.should_descend(make_file("/电影/sample/"), 1)
+    assert not file_filter.should_descend(make_file("/a/tmp/"), 1)
+    assert file_filter.should_descend(make_file("/电影/正片/"), 1)
+
+
+def test_size_comparisons():
+    file_filter = compile_rules(["size >= 1MB", "size < 1GB"])
+    assert file_filter.check_file(make_file("/a", size=1024 * 1024 - 1), 1) == "文件过小"
+    assert file_filter.match_file(make_file("/a", size=1024 * 1024), 1)
+    assert file_filter.check_file(make_file("/a", size=1024 ** 3), 1) == "文件过大"
+
+
+def test_mtime_relative_and_unknown():
+    file_filter = compile_rules(["mtime >= 7d"])
+    assert file_filter.match_file(make_file("/a", modified=formatdate(time.time() - 86400, usegmt=True)), 1)
+    old = formatdate(time.time() - 30 * 86400, usegmt=True)
+    assert file_filter.check_file(make_file("/a", modified=old), 1) == "修改时间过早"
+    # 无法获取修改时间的文件不受时间规则限制
+    assert file_filter.match_file(make_file("/a"), 1)
+
+
+def test_depth_limits_descend_and_files():
+    file_filter = compile_rules(["depth <= 2"])
+    assert file_filter.should_descend(make_file("/a/"), 1)
+    assert not file_filter.should_descend(make_file("/a/b/"), 2)
+    assert file_filter.check_file(make_file("/a/b/c/d"), 3) == "超出目录深度"
+
+
+def test_comments_and_blank_lines_are_ignored():
+    file_filter = compile_rules("# 注释\n\ninclude *.mkv\n")
+    assert file_filter.description == "include *.mkv"
+
+
+@pytest.mark.parametrize("rule", [
+    "include",
+    "include re:(",
+    "size >= lots",
+    "mtime >= yesterday",
+    "depth <= 1.5",
+    "frobnicate *.mkv",
+])
+def test_invalid_rules_raise_filter_rule_error(rule):
+    with pytest.raises(FilterRuleError):
+        compile_rules([rule])
+
+
+def test_chain_requires_all_filters():
+    chain = FilterChain([compile_rules(["include *.mkv"]), compile_rules(["size >= 1KB"])])
+    assert chain.check_file(make_file("/a.mkv", size=10), 1) == "文件过小"
+    assert chain.match_file(make_file("/a.mkv", size=2048), 1)
+
+
+@pytest.mark.parametrize("rules", [5, [5], {"include": "*.mkv"}, ["include *.mkv", None]])
+def test_rules_of_wrong_type_raise_filter_rule_error(rules):
+    with pytest.raises(FilterRuleError):
+        compile_rules(rules)
@@ -1,17 +1,27 @@
 import asyncio
 import json
 import logging
-from typing import List, Dict, Any, Optional
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from urllib.parse import urljoin, urlparse, unquote
 import requests
+from requests.adapters import HTTPAdapter
 from dataclasses import dataclass
 import re
 import xml.etree.ElementTree as ET
-from datetime import datetime
-import aria2p
+from datetime import datetime, timezone as datetime_timezone
+from email.utils import parsedate_to_datetime
+from metrics import (
+    PROPFIND_SECONDS, PROPFIND_RESPONSE_BYTES, XML_PARSE_SECONDS, LISTING_ENTRIES,
+    ARIA2_RPC_SECONDS, WEBDAV_RETRIES, WEBDAV_REQUESTS, WEBDAV_CONNECTIONS_OPENED
+)
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
+# 配置日志（可通过W2A_LOG_LEVEL调整，如DEBUG输出逐文件日志）
+logging.basicConfig(level=os.environ.get("W2A_LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -23,18 +33,175 @@ class WebDavFile:
     size: int = 0
     modified: str = ""
     download_url: str = ""
+    etag: str = ""
+
+@dataclass
+class TransportConfig:
+    """WebDAV传输层配置"""
+    pool_connections: int = 10      # 缓存的主机连接池数量
+    pool_maxsize: int = 32          # 每个主机的最大连接数
+    keep_alive: bool = True
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+    max_retries: int = 3
+    backoff_factor: float = 0.5     # 退避基数（秒），第n次重试最多等待 backoff_factor * 2^n
+    backoff_max: float = 30.0
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+    compress: bool = True           # 请求gzip压缩的响应体
+    http2: bool = False             # 使用httpx的HTTP/2多路复用（需安装httpx[http2]）
+    
+    @classmethod
+    def from_env(cls) -> "TransportConfig":
+        """从W2A_WEBDAV_*环境变量读取配置"""
+        def env(name, cast, default):
+            value = os.environ.get(f"W2A_WEBDAV_{name}")
+            if value is None or value == "":
+                return default
+            if cast is bool:
+                return value.lower() in ("1", "true", "yes", "on")
+            return cast(value)
+        
+        defaults = cls()
+        return cls(
+            pool_connections=env("POOL_CONNECTIONS", int, defaults.pool_connections),
+            pool_maxsize=env("POOL_MAXSIZE", int, defaults.pool_maxsize),
+            keep_alive=env("KEEP_ALIVE", bool, defaults.keep_alive),
+            connect_timeout=env("CONNECT_TIMEOUT", float, defaults.connect_timeout),
+            read_timeout=env("READ_TIMEOUT", float, defaults.read_timeout),
+            max_retries=env("MAX_RETRIES", int, defaults.max_retries),
+            backoff_factor=env("BACKOFF_FACTOR", float, defaults.backoff_factor),
+            backoff_max=env("BACKOFF_MAX", float, defaults.backoff_max),
+            compress=env("COMPRESS", bool, defaults.compress),
+            http2=env("HTTP2", bool, defaults.http2),
+        )
+
+class _CountingAdapter(HTTPAdapter):
+    """每新建一个连接调用一次on_new_connection的HTTPAdapter"""
+    
+    def __init__(self, on_new_connection, **kwargs):
+        self._on_new_connection = on_new_connection
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        on_new_connection = self._on_new_connection
+        
+        def counting(pool_class):
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    on_new_connection()
+                    return super()._new_conn()
+            return CountingPool
+        
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: counting(pool_class) for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
 
 class WebDavClient:
     """WebDAV客户端，用于连接和操作WebDAV服务器"""
     
-    def __init__(self, base_url: str, username: str = "", password: str = ""):
+    def __init__(self, base_url: str, username: str = "", password: str = "",
+                 transport: Optional[TransportConfig] = None):
         self.base_url = base_url.rstrip('/')
         self.username = username
         self.password = password
+        self.transport = transport or TransportConfig.from_env()
+        
+        # 指标标签：服务器地址（不含认证信息）
+        self.server_label = urlparse(self.base_url).netloc.rsplit('@', 1)[-1]
+        
+        headers = {
+            'Accept-Encoding': 'gzip, deflate' if self.transport.compress else 'identity'
+        }
+        if not self.transport.keep_alive:
+            headers['Connection'] = 'close'
+        
         self.session = requests.Session()
+        self.session.headers.update(headers)
+        # 重试由_make_request统一处理，适配器本身不重试；
+        # pool_block使pool_maxsize成为同时打开连接数的上限（而不仅是保留的长连接数），
+        # 连接池用满时请求等待空闲连接
+        adapter = _CountingAdapter(
+            self._count_new_connection,
+            pool_connections=self.transport.pool_connections,
+            pool_maxsize=self.transport.pool_maxsize,
+            pool_block=True,
+            max_retries=0
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._adapter = adapter
         
         if username and password:
             self.session.auth = (username, password)
+        
+        self._http2_client = None
+        self._transient_errors: Tuple[type, ...] = (requests.ConnectionError, requests.Timeout)
+        self._request_errors: Tuple[type, ...] = (requests.RequestException,)
+        if self.transport.http2:
+            self._init_http2(headers)
+        
+        self._stats_lock = threading.Lock()
+        self._request_count = 0
+        self._retry_count = 0
+        self._connection_count = 0
+    
+    def _count_new_connection(self):
+        with self._stats_lock:
+            self._connection_count += 1
+        WEBDAV_CONNECTIONS_OPENED.inc(server=self.server_label)
+    
+    def _init_http2(self, headers: Dict[str, str]):
+        """初始化HTTP/2客户端，依赖不可用时回退到requests"""
+        try:
+            import httpx
+            limits = httpx.Limits(
+                max_connections=self.transport.pool_maxsize,
+                max_keepalive_connections=self.transport.pool_maxsize if self.transport.keep_alive else 0
+            )
+            self._http2_client = httpx.Client(
+                http2=True,
+                auth=(self.username, self.password) if self.username and self.password else None,
+                headers=headers,
+                limits=limits,
+                timeout=httpx.Timeout(self.transport.read_timeout, connect=self.transport.connect_timeout)
+            )
+            self._transient_errors += (httpx.TransportError,)
+            self._request_errors += (httpx.HTTPError,)
+        except ImportError as e:
+            logger.warning(f"HTTP/2不可用，使用HTTP/1.1: {e}")
+            self._http2_client = None
+    
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+        if self._http2_client is not None:
+            self._http2_client.close()
+    
+    def transport_stats(self) -> Dict[str, Any]:
+        """连接复用统计"""
+        with self._stats_lock:
+            requests_sent = self._request_count
+            retries = self._retry_count
+            connections = self._connection_count
+        
+        stats = {
+            "server": self.server_label,
+            "http2": self._http2_client is not None,
+            "requests": requests_sent,
+            "retries": retries,
+            "pool_maxsize": self.transport.pool_maxsize,
+            "connections_opened": None,
+            "connection_reuse_ratio": None
+        }
+        
+        if self._http2_client is None:
+            # 根据新建连接数计算复用率
+            stats["connections_opened"] = connections
+            if requests_sent:
+                stats["connection_reuse_ratio"] = round(max(0.0, 1 - connections / requests_sent), 4)
+        
+        return stats
     
     def _build_download_url(self, href: str) -> str:
         """构建包含认证信息的下载URL"""
@@ -62,19 +229,118 @@ class WebDavClient:
         
         return download_url
     
-    def _make_request(self, method: str, path: str, **kwargs) -> requests.Response:
-        """发送HTTP请求"""
+    def _send(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, data=None):
+        if self._http2_client is not None:
+            return self._http2_client.request(method, url, headers=headers, content=data)
+        timeout = (self.transport.connect_timeout, self.transport.read_timeout)
+        return self.session.request(method, url, headers=headers, data=data, timeout=timeout)
+    
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        """计算重试等待时间：优先遵循Retry-After，否则使用带抖动的指数退避"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(datetime_timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), self.transport.backoff_max)
+        
+        # full jitter
+        return random.uniform(0, min(self.transport.backoff_max, self.transport.backoff_factor * (2 ** attempt)))
+    
+    def _make_request(self, method: str, path: str, headers: Optional[Dict[str, str]] = None, data=None):
+        """发送HTTP请求，对连接错误和429/5xx进行重试"""
         url = urljoin(self.base_url, path.lstrip('/'))
+        attempt = 0
+        while True:
+            with self._stats_lock:
+                self._request_count += 1
+            WEBDAV_REQUESTS.inc(server=self.server_label)
+            try:
+                response = self._send(method, url, headers=headers, data=data)
+            except self._transient_errors as e:
+                if attempt >= self.transport.max_retries:
+                    logger.error(f"请求失败: {e}")
+                    raise
+                reason = "connection"
+                delay = self._retry_delay(attempt)
+            except self._request_errors as e:
+                logger.error(f"请求失败: {e}")
+                raise
+            else:
+                if response.status_code not in self.transport.retry_statuses or attempt >= self.transport.max_retries:
+                    try:
+                        response.raise_for_status()
+                    except self._request_errors as e:
+                        logger.error(f"请求失败: {e}")
+                        # 连接池为阻塞模式，未读取的响应须关闭以归还连接
+                        response.close()
+                        raise
+                    return response
+                reason = str(response.status_code)
+                delay = self._retry_delay(attempt, response)
+                response.close()
+            
+            attempt += 1
+            with self._stats_lock:
+                self._retry_count += 1
+            WEBDAV_RETRIES.inc(server=self.server_label, reason=reason)
+            logger.warning(f"请求重试: method={method} path={path} reason={reason} attempt={attempt} delay={delay:.2f}s")
+            time.sleep(delay)
+    
+    def stat(self, path: str) -> Optional[WebDavFile]:
+        """获取单个资源的属性（Depth: 0）"""
         try:
-            response = self.session.request(method, url, **kwargs)
-            response.raise_for_status()
-            return response
-        except requests.RequestException as e:
-            logger.error(f"请求失败: {e}")
-            raise
+            headers = {
+                'Depth': '0',
+                'Content-Type': 'application/xml'
+            }
+            
+            propfind_body = '''<?xml version="1.0" encoding="utf-8" ?>
+            <D:propfind xmlns:D="DAV:">
+                <D:allprop/>
+            </D:propfind>'''
+            
+            with PROPFIND_SECONDS.time(server=self.server_label):
+                response = self._make_request('PROPFIND', path, headers=headers, data=propfind_body)
+            
+            files = self._parse_propfind_response(response.text, path, include_self=True)
+            return files[0] if files else None
+            
+        except Exception as e:
+            logger.error(f"获取资源属性失败: {e}")
+            return None
+    
+    def warm_up(self, connections: int = 1):
+        """预先建立连接：并发发送Depth: 0的PROPFIND，使连接池中保留多个长连接
+        
+        与stat不同，失败时抛出异常。
+        """
+        connections = max(1, min(connections, self.transport.pool_maxsize))
+        headers = {
+            'Depth': '0',
+            'Content-Type': 'application/xml'
+        }
+        
+        def probe():
+            with PROPFIND_SECONDS.time(server=self.server_label):
+                self._make_request('PROPFIND', '/', headers=headers).close()
+        
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="w2a-warmup") as executor:
+            futures = [executor.submit(probe) for _ in range(connections)]
+            for future in futures:
+                future.result()
     
-    def list_directory(self, path: str = "/") -> List[WebDavFile]:
-        """列出目录内容"""
+    def list_directory(self, path: str = "/", strict: bool = False) -> List[WebDavFile]:
+        """列出目录内容
+
+        默认在PROPFIND失败时回退到HTTP目录列表，仍失败则返回空列表；
+        strict=True时直接抛出异常，供需要区分空目录和列表失败的调用方使用。
+        """
         try:
             # WebDAV PROPFIND请求
             headers = {
@@ -87,18 +353,24 @@ class WebDavClient:
                 <D:allprop/>
             </D:propfind>'''
             
-            response = self._make_request('PROPFIND', path, headers=headers, data=propfind_body)
+            with PROPFIND_SECONDS.time(server=self.server_label):
+                response = self._make_request('PROPFIND', path, headers=headers, data=propfind_body)
+            PROPFIND_RESPONSE_BYTES.observe(len(response.content), server=self.server_label)
             
             # 解析WebDAV响应
-            files = self._parse_propfind_response(response.text, path)
+            with XML_PARSE_SECONDS.time():
+                files = self._parse_propfind_response(response.text, path)
+            LISTING_ENTRIES.observe(len(files))
             return files
             
         except Exception as e:
             logger.error(f"列出目录失败: {e}")
+            if strict:
+                raise
             # 如果WebDAV失败，尝试简单的HTTP目录列表
             return self._try_http_directory_listing(path)
     
-    def _parse_propfind_response(self, xml_content: str, base_path: str) -> List[WebDavFile]:
+    def _parse_propfind_response(self, xml_content: str, base_path: str, include_self: bool = False) -> List[WebDavFile]:
         """解析WebDAV PROPFIND响应"""
         files = []
         
@@ -125,13 +397,16 @@ class WebDavClient:
                     href = unquote(href_elem.text.strip())
                     
                     # 跳过当前目录
-                    if href.rstrip('/') == base_path.rstrip('/'):
+                    if not include_self and href.rstrip('/') == base_path.rstrip('/'):
                         continue
                     
                     # 提取文件名
                     name = href.split('/')[-1] if not href.endswith('/') else href.split('/')[-2]
                     if not name:
-                        continue
+                        # 根目录没有名称；stat需要它的ETag/修改时间，以"/"命名
+                        if not include_self:
+                            continue
+                        name = '/'
                     
                     # 判断是否为目录
                     resourcetype = response.find('.//D:resourcetype', namespaces) or response.find('.//d:resourcetype', namespaces)
@@ -160,6 +435,12 @@ class WebDavClient:
                     if modified_elem is not None and modified_elem.text:
                         modified = modified_elem.text
                     
+                    # 获取ETag
+                    etag = ""
+                    etag_elem = response.find('.//D:getetag', namespaces) or response.find('.//d:getetag', namespaces)
+                    if etag_elem is not None and etag_elem.text:
+                        etag = etag_elem.text.strip()
+                    
                     # 构建下载URL（包含认证信息）
                     download_url = self._build_download_url(href)
                     
@@ -169,7 +450,8 @@ class WebDavClient:
                         is_directory=is_directory,
                         size=size,
                         modified=modified,
-                        download_url=download_url
+                        download_url=download_url,
+                        etag=etag
                     ))
                     
                 except Exception as e:
@@ -311,6 +593,9 @@ class Aria2Client:
             
             logger.info(f"尝试连接Aria2: {host_with_protocol}:{port}")
             
+            # aria2p依赖较多，首次连接时才导入，不影响服务启动速度
+            import aria2p
+            
             # 创建aria2p客户端 - host参数需要包含协议
             client = aria2p.Client(
                 host=host_with_protocol,
@@ -332,7 +617,8 @@ class Aria2Client:
             
             if self.aria2:
                 # 尝试获取版本信息来测试连接
-                version = self.aria2.client.get_version()
+                with ARIA2_RPC_SECONDS.time(method="getVersion"):
+                    version = self.aria2.client.get_version()
                 return True
         except Exception as e:
             logger.error(f"Aria2连接测试失败: {e}")
@@ -353,7 +639,8 @@ class Aria2Client:
                     aria2_options[key] = value
             
             # 添加下载
-            download = self.aria2.add_uris([url], options=aria2_options)
+            with ARIA2_RPC_SECONDS.time(method="addUri"):
+                download = self.aria2.add_uris([url], options=aria2_options)
             return download.gid
             
         except Exception as e:
@@ -366,7 +653,8 @@ class Aria2Client:
             if not self.aria2:
                 raise Exception("Aria2未连接")
             
-            version_info = self.aria2.client.get_version()
+            with ARIA2_RPC_SECONDS.time(method="getVersion"):
+                version_info = self.aria2.client.get_version()
             return version_info
             
         except Exception as e:
@@ -379,7 +667,8 @@ class Aria2Client:
             if not self.aria2:
                 raise Exception("Aria2未连接")
             
-            downloads = self.aria2.get_downloads()
+            with ARIA2_RPC_SECONDS.time(method="getDownloads"):
+                downloads = self.aria2.get_downloads()
             result = []
             
             for download in downloads:
@@ -403,9 +692,12 @@ class Aria2Client:
                         }
                         if hasattr(file, 'uris') and file.uris:
                             for uri in file.uris:
-                                file_data["uris"].append({
-                                    "uri": uri.uri if hasattr(uri, 'uri') else str(uri)
-                                })
+                                # aria2p以字典形式返回URI：{"uri": ..., "status": ...}
+                                if isinstance(uri, dict):
+                                    uri = uri.get("uri", "")
+                                elif hasattr(uri, 'uri'):
+                                    uri = uri.uri
+                                file_data["uris"].append({"uri": str(uri)})
                         download_data["files"].append(file_data)
                 else:
                     # 如果没有files信息，创建一个默认的
@@ -429,8 +721,9 @@ class Aria2Client:
             if not self.aria2:
                 raise Exception("Aria2未连接")
             
-            download = self.aria2.get_download(gid)
-            download.pause()
+            with ARIA2_RPC_SECONDS.time(method="pause"):
+                download = self.aria2.get_download(gid)
+                download.pause()
             return True
             
         except Exception as e:
@@ -443,8 +736,9 @@ class Aria2Client:
             if not self.aria2:
                 raise Exception("Aria2未连接")
             
-            download = self.aria2.get_download(gid)
-            download.resume()
+            with ARIA2_RPC_SECONDS.time(method="unpause"):
+                download = self.aria2.get_download(gid)
+                download.resume()
             return True
             
         except Exception as e:
@@ -457,8 +751,9 @@ class Aria2Client:
             if not self.aria2:
                 raise Exception("Aria2未连接")
             
-            download = self.aria2.get_download(gid)
-            download.remove()
+            with ARIA2_RPC_SECONDS.time(method="remove"):
+                download = self.aria2.get_download(gid)
+                download.remove()
             return True
             
         except Exception as e: